@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import multiprocessing
+from ftplib import FTP
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from quickftp.qftp_auth import QuickFtpPasswordVerifier
+from quickftp.qftp_server import QuickFtpServer
+
+
+def serve(configfile):
+    QuickFtpServer(configfile).serve()
+
+
+def write_config(dname, port, scheme, cache_size, concurrency):
+    """
+    :return: path of a server configuration file with a single user 'bench' / 'bench'
+    """
+    configfile = os.path.join(dname, 'server_%s_%d.yml' % (scheme, cache_size))
+    with open(configfile, 'w') as file:
+        file.write('ip: 127.0.0.1\n')
+        file.write('port: %d\n' % port)
+        file.write('ftp_root_dir: %s\n' % os.path.join(dname, 'root'))
+        file.write('concurrency: %s\n' % concurrency)
+        file.write('password_cache_size: %d\n' % cache_size)
+        file.write('clients:\n')
+        file.write('  - name: bench\n')
+        file.write("    password: '%s'\n" % QuickFtpPasswordVerifier.hash_password('bench', scheme))
+        file.write('    directory: bench\n')
+    return configfile
+
+
+def login(port):
+    ftp = FTP()
+    ftp.connect('127.0.0.1', port)
+    ftp.login('bench', 'bench')
+    ftp.quit()
+
+
+def measure(port, logins, clients):
+    """
+    :return: logins per second with 'clients' concurrent connections
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(lambda i: login(port), range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument('-p', '--port', dest="port", type=int, default=12400, help="first server port")
+    parser.add_argument('-n', '--logins', dest="logins", type=int, default=500, help="logins per measure")
+    parser.add_argument('-c', '--clients', dest="clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument('-s', '--schemes', dest="schemes", default='md5,pbkdf2_sha256,scrypt',
+                        help="comma separated password schemes")
+    parser.add_argument('--concurrency', dest="concurrency", default='async', help="server concurrency model")
+    parser.add_argument('-o', '--output', dest="output", help="write the results in a json file")
+    args = parser.parse_args()
+
+    results = []
+    port = args.port
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scheme in args.schemes.split(','):
+            for cache_size in [0, 1024]:
+                configfile = write_config(tmp_dir, port, scheme, cache_size, args.concurrency)
+                server = multiprocessing.Process(target=serve, args=(configfile,), daemon=True)
+                server.start()
+                time.sleep(1)
+                try:
+                    rate = measure(port, args.logins, args.clients)
+                finally:
+                    server.terminate()
+                    server.join()
+                port += 1
+                results.append({'scheme': scheme, 'cache_size': cache_size, 'clients': args.clients,
+                                'logins_s': rate})
+                print('%-14s cache %5d: %8.1f logins/s with %d concurrent clients'
+                      % (scheme, cache_size, rate, args.clients))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
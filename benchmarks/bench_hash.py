@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from hashlib import md5
+from hashlib import sha256
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from quickftp.qftp_helper import Helpers
+
+
+def legacy_compute_file_hash(fname, hash_type):
+    """
+    Helpers.compute_file_hash as it was before: 4096 bytes reads.
+    """
+    file_hash = md5() if hash_type == 'md5' else sha256()
+    with open(fname, "rb") as f:
+        for data in iter(lambda: f.read(4096), b""):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def measure(function, repeat):
+    """
+    :return: best elapsed time in seconds over repeat runs
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def create_file(dname, size):
+    fname = os.path.join(dname, 'file_%d' % size)
+    with open(fname, 'wb') as file:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 1024 * 1024)
+            file.write(os.urandom(chunk))
+            remaining -= chunk
+    return fname
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hash throughput benchmark")
+    parser.add_argument('-t', '--hash-type', dest="hash_type", default='sha256', help="md5 or sha256")
+    parser.add_argument('-s', '--sizes', dest="sizes", default='4096,1048576,67108864',
+                        help="comma separated file sizes in bytes")
+    parser.add_argument('-n', '--files', dest="files", type=int, default=16, help="number of files of the batch test")
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=os.cpu_count(), help="batch threads")
+    parser.add_argument('-r', '--repeat', dest="repeat", type=int, default=3, help="runs per measure")
+    parser.add_argument('-o', '--output', dest="output", help="write the results in a json file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            fname = create_file(tmp_dir, size)
+            legacy = measure(lambda: legacy_compute_file_hash(fname, args.hash_type), args.repeat)
+            current = measure(lambda: Helpers.compute_file_hash(fname, args.hash_type), args.repeat)
+            results.append({'test': 'single', 'size': size,
+                            'legacy_mb_s': size / legacy / 1e6, 'current_mb_s': size / current / 1e6})
+            print('single %12d bytes: legacy %8.1f MB/s, current %8.1f MB/s (x%.2f)'
+                  % (size, size / legacy / 1e6, size / current / 1e6, legacy / current))
+
+        size = int(args.sizes.split(',')[-1])
+        batch_dir = os.path.join(tmp_dir, 'batch')
+        os.makedirs(batch_dir)
+        fnames = [create_file(batch_dir, size + i) for i in range(args.files)]
+        total = sum(os.path.getsize(fname) for fname in fnames)
+        sequential = measure(lambda: [legacy_compute_file_hash(f, args.hash_type) for f in fnames], args.repeat)
+        batch = measure(lambda: Helpers.compute_files_hash(fnames, args.hash_type, args.workers), args.repeat)
+        results.append({'test': 'batch', 'files': args.files, 'size': total, 'workers': args.workers,
+                        'legacy_mb_s': total / sequential / 1e6, 'current_mb_s': total / batch / 1e6})
+        print('batch  %12d bytes: legacy %8.1f MB/s, current %8.1f MB/s (x%.2f) with %d threads'
+              % (total, total / sequential / 1e6, total / batch / 1e6, sequential / batch, args.workers))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.append(ROOT_DIR)
+
+# run in a fresh interpreter: import the client, then create clients from a configuration file
+CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+from quickftp.qftp_client import QuickFtpClient
+imported = time.perf_counter()
+QuickFtpClient(sys.argv[1])
+first = time.perf_counter()
+for i in range(%d):
+    QuickFtpClient(sys.argv[1])
+end = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_client_ms': (first - imported) * 1000,
+                  'next_client_ms': (end - first) * 1000 / %d,
+                  'modules': [name for name in ['yaml', 'pyftpdlib', 'http.server'] if name in sys.modules]}))
+'''
+
+
+def write_config(dname):
+    """
+    :return: path of a client configuration file, no server is needed: the client connects at first use
+    """
+    configfile = os.path.join(dname, 'client.yml')
+    with open(configfile, 'w') as file:
+        file.write('ip: 127.0.0.1\nport: 12700\nusername: bench\npassword: bench\n')
+        file.write('workspace: %s\n' % os.path.join(dname, 'workspace'))
+    return configfile
+
+
+def measure(configfile, clients):
+    """
+    :return: measures of a fresh interpreter, and its total run time in ms
+    """
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD % (clients, clients), configfile], check=True,
+                            capture_output=True, cwd=ROOT_DIR, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Client startup time benchmark")
+    parser.add_argument('-r', '--repeat', dest="repeat", type=int, default=20, help="fresh interpreters")
+    parser.add_argument('-n', '--clients', dest="clients", type=int, default=100,
+                        help="clients created per interpreter after the first one")
+    parser.add_argument('-o', '--output', dest="output", help="write the results in a json file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        configfile = write_config(tmp_dir)
+        runs = [measure(configfile, args.clients) for i in range(args.repeat)]
+
+    results = {'python': sys.version.split()[0], 'modules_loaded': runs[0]['modules']}
+    for key in ['process_ms', 'import_ms', 'first_client_ms', 'next_client_ms']:
+        results[key] = statistics.median(run[key] for run in runs)
+    print('interpreter %7.2f ms, import %7.2f ms, first client %6.2f ms, next clients %6.3f ms'
+          % (results['process_ms'], results['import_ms'], results['first_client_ms'], results['next_client_ms']))
+    print('modules loaded: %s' % (', '.join(results['modules_loaded']) or 'none of yaml, pyftpdlib, http.server'))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import multiprocessing
+from ftplib import FTP
+from hashlib import md5
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from quickftp.qftp_helper import Helpers
+from quickftp.qftp_client import QuickFtpClient
+from quickftp.qftp_server import QuickFtpServer
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+def serve(configfile):
+    QuickFtpServer(configfile).serve()
+
+
+def write_file(fname, size, rand):
+    """
+    Write a file of pseudo-random content and its md5 signature file
+    """
+    with open(fname, 'wb') as file:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 1024 * 1024)
+            file.write(rand.randbytes(chunk))
+            remaining -= chunk
+    with open(fname + '.md5', 'w') as file:
+        file.write(Helpers.compute_file_hash(fname, 'md5'))
+
+
+def generate_trees(user_dir, args):
+    """
+    Generate the synthetic trees of the scenarios, the content only depends on the seed
+    :return: dictionary {scenario: (number of files, total size)}
+    """
+    rand = random.Random(args.seed)
+    trees = dict()
+
+    small = os.path.join(user_dir, 'small')
+    os.makedirs(small)
+    for i in range(args.small_files):
+        write_file(os.path.join(small, 'file_%05d' % i), args.small_size, rand)
+    trees['small'] = (args.small_files, args.small_files * args.small_size)
+
+    huge = os.path.join(user_dir, 'huge')
+    os.makedirs(huge)
+    for i in range(args.huge_files):
+        write_file(os.path.join(huge, 'file_%d' % i), args.huge_size, rand)
+    trees['huge'] = (args.huge_files, args.huge_files * args.huge_size)
+
+    dname = os.path.join(user_dir, 'deep')
+    for level in range(args.depth):
+        dname = os.path.join(dname, 'level_%d' % level)
+        os.makedirs(dname)
+        for i in range(args.deep_files):
+            write_file(os.path.join(dname, 'file_%d' % i), args.small_size, rand)
+    trees['deep'] = (args.depth * args.deep_files, args.depth * args.deep_files * args.small_size)
+    return trees
+
+
+def write_configs(tmp_dir, args):
+    """
+    :return: server and client configuration file paths
+    """
+    server_conf = os.path.join(tmp_dir, 'server.yml')
+    with open(server_conf, 'w') as file:
+        file.write('ip: 127.0.0.1\nport: %d\n' % args.port)
+        file.write('ftp_root_dir: %s\n' % os.path.join(tmp_dir, 'root'))
+        file.write('concurrency: %s\n' % args.concurrency)
+        if args.compression:
+            file.write('compression: true\n')
+        file.write('clients:\n  - name: %s\n    password: %s\n    directory: %s\n'
+                   % (USERNAME, md5(PASSWORD.encode('utf-8')).hexdigest(), USERNAME))
+
+    client_conf = os.path.join(tmp_dir, 'client.yml')
+    with open(client_conf, 'w') as file:
+        file.write('ip: 127.0.0.1\nport: %d\n' % args.port)
+        file.write('username: %s\npassword: %s\n' % (USERNAME, PASSWORD))
+        file.write('workspace: %s\n' % os.path.join(tmp_dir, 'workspace'))
+        if args.compression:
+            file.write('compression: true\n')
+    return server_conf, client_conf
+
+
+def first_data_file(dname, user_dir):
+    """
+    :return: path relative to the user directory of the first file of a tree, signature files excluded
+    """
+    for root, dirs, files in os.walk(dname):
+        dirs.sort()
+        for f in sorted(files):
+            if not f.endswith('.md5'):
+                return os.path.relpath(os.path.join(root, f), user_dir)
+    raise Exception('No file in %s' % dname)
+
+
+def time_to_first_byte(port, fpath):
+    """
+    :return: seconds between the RETR command and the first data byte, on a logged-in session
+    """
+    ftp = FTP()
+    ftp.connect('127.0.0.1', port)
+    ftp.login(USERNAME, PASSWORD)
+    try:
+        start = time.perf_counter()
+        with ftp.transfercmd('RETR ' + fpath) as conn:
+            conn.recv(1)
+            elapsed = time.perf_counter() - start
+        # end of transfer reply, 426 as the transfer is aborted
+        ftp.getmultiline()
+    finally:
+        ftp.close()
+    return elapsed
+
+
+def run(client_conf, scenario, verify, workers):
+    """
+    Get the tree of a scenario in an empty workspace
+    :return: (elapsed seconds, listing seconds, listing requests)
+    """
+    with QuickFtpClient(client_conf) as client:
+        shutil.rmtree(client.workspace)
+        os.makedirs(client.workspace)
+        start = time.perf_counter()
+        client.get(scenario, verify=verify, workers=workers)
+        elapsed = time.perf_counter() - start
+        listing = dict()
+        for command in ['MLSD', 'XMANIFEST']:
+            listing[command] = client.metrics.get('quickftp_client_listing_seconds', command=command)
+    return (elapsed, sum(value['sum'] for value in listing.values()),
+            sum(value['count'] for value in listing.values()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Transfer throughput and latency benchmark")
+    parser.add_argument('-p', '--port', dest="port", type=int, default=12500, help="server port")
+    parser.add_argument('--seed', dest="seed", type=int, default=0, help="seed of the generated content")
+    parser.add_argument('--small-files', dest="small_files", type=int, default=500, help="files of the small tree")
+    parser.add_argument('--small-size', dest="small_size", type=int, default=4096, help="size of small files")
+    parser.add_argument('--huge-files', dest="huge_files", type=int, default=2, help="files of the huge tree")
+    parser.add_argument('--huge-size', dest="huge_size", type=int, default=128 * 1024 * 1024,
+                        help="size of huge files")
+    parser.add_argument('--depth', dest="depth", type=int, default=20, help="levels of the deep tree")
+    parser.add_argument('--deep-files', dest="deep_files", type=int, default=5, help="files per level")
+    parser.add_argument('-s', '--scenarios', dest="scenarios", default='small,huge,deep',
+                        help="comma separated scenarios")
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=1, help="client workers")
+    parser.add_argument('-r', '--repeat', dest="repeat", type=int, default=3, help="runs per measure")
+    parser.add_argument('--concurrency', dest="concurrency", default='async', help="server concurrency model")
+    parser.add_argument('--compression', dest="compression", action='store_true', help="transfer in MODE Z")
+    parser.add_argument('-o', '--output', dest="output", help="write the results in a json file")
+    args = parser.parse_args()
+
+    results = {'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                               'cpus': os.cpu_count()},
+               'parameters': vars(args), 'results': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        user_dir = os.path.join(tmp_dir, 'root', USERNAME)
+        os.makedirs(user_dir)
+        trees = generate_trees(user_dir, args)
+        server_conf, client_conf = write_configs(tmp_dir, args)
+
+        server = multiprocessing.Process(target=serve, args=(server_conf,), daemon=True)
+        server.start()
+        time.sleep(1)
+        try:
+            for scenario in args.scenarios.split(','):
+                files, size = trees[scenario]
+                first_file = first_data_file(os.path.join(user_dir, scenario), user_dir)
+                ttfb = statistics.median(time_to_first_byte(args.port, first_file) for i in range(args.repeat))
+                for verify in [None, 'md5']:
+                    runs = [run(client_conf, scenario, verify, args.workers) for i in range(args.repeat)]
+                    elapsed = min(elapsed for elapsed, listing, requests in runs)
+                    listing = min(listing for elapsed, listing, requests in runs)
+                    requests = runs[0][2]
+                    result = {'scenario': scenario, 'verify': verify, 'files': files, 'size': size,
+                              'seconds': elapsed, 'files_s': files / elapsed, 'mb_s': size / elapsed / 1e6,
+                              'ttfb_ms': ttfb * 1000, 'listing_ms': listing * 1000, 'listing_requests': requests}
+                    results['results'].append(result)
+                    print('%-6s verify %-4s: %8.1f files/s %8.1f MB/s, ttfb %6.2f ms, listing %7.2f ms (%d requests)'
+                          % (scenario, verify or '-', result['files_s'], result['mb_s'], result['ttfb_ms'],
+                             result['listing_ms'], requests))
+        finally:
+            server.terminate()
+            server.join()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,476 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from ftplib import error_perm, error_temp, error_reply
+from quickftp.qftp_helper import Helpers
+from quickftp.qftp_client import QuickFtpListingCache
+
+
+class AsyncFtpSession:
+    """
+    This provides a minimal FTP control connection on asyncio streams (login, PWD, MLSD and RETR).
+    """
+    def __init__(self, host, port, encoding='utf-8'):
+        """
+        Constructor
+        :param host: server address
+        :param port: server port
+        :param encoding: encoding of the control connection
+        """
+        self.host = host
+        self.port = port
+        self.encoding = encoding
+        self.reader = None
+        self.writer = None
+        self.binary = False
+
+    async def connect(self, username, password):
+        """
+        Connect and login to the server
+        :param username: user name
+        :param password: password
+        :return:
+        """
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.binary = False
+        await self.get_response('2')
+        code, text = await self.command('USER ' + username, '23')
+        if code == 331:
+            await self.command('PASS ' + password, '2')
+
+    async def get_response(self, expected='2'):
+        """
+        Read a (multi-line) response
+        :param expected: accepted first digits of the response code
+        :return: (response code, response text)
+        """
+        line = (await self.reader.readline()).decode(self.encoding)
+        if not line:
+            raise EOFError
+        text = line
+        if line[3:4] == '-':
+            end = line[:3] + ' '
+            while not line.startswith(end):
+                line = (await self.reader.readline()).decode(self.encoding)
+                if not line:
+                    raise EOFError
+                text += line
+        text = text.rstrip('\r\n')
+        if text[:1] == '4':
+            raise error_temp(text)
+        if text[:1] == '5':
+            raise error_perm(text)
+        if not any(text.startswith(code) for code in expected):
+            raise error_reply(text)
+        return int(text[:3]), text
+
+    async def command(self, line, expected='2'):
+        """
+        Send a command and read its response
+        :param line: command line
+        :param expected: accepted first digits of the response code
+        :return: (response code, response text)
+        """
+        self.writer.write((line + '\r\n').encode(self.encoding))
+        await self.writer.drain()
+        return await self.get_response(expected)
+
+    async def pwd(self):
+        """
+        :return: the current directory
+        """
+        code, text = await self.command('PWD')
+        return text.split('"')[1]
+
+    async def __open_data_connection(self, line, rest=None):
+        """
+        Private function to open a passive data connection and start a transfer command
+        :param line: transfer command line
+        :param rest: restart offset
+        :return: (data reader, data writer)
+        """
+        code, text = await self.command('EPSV')
+        port = int(re.search(r'\(\|\|\|(\d+)\|\)', text).group(1))
+        data_reader, data_writer = await asyncio.open_connection(self.host, port)
+        try:
+            if rest:
+                await self.command('REST %d' % rest, '3')
+            await self.command(line, '1')
+        except Exception:
+            data_writer.close()
+            raise
+        return data_reader, data_writer
+
+    async def mlsd(self, dpath, facts):
+        """
+        List a directory
+        :param dpath: directory path on the server
+        :param facts: list of requested facts
+        :return: list of (name, facts dictionary)
+        """
+        await self.command('OPTS MLST ' + ''.join(fact + ';' for fact in facts))
+        data_reader, data_writer = await self.__open_data_connection('MLSD ' + dpath if dpath else 'MLSD')
+        try:
+            data = await data_reader.read()
+        finally:
+            data_writer.close()
+        await self.get_response('2')
+
+        content = []
+        for line in data.decode(self.encoding).splitlines():
+            facts_found, _, name = line.rstrip('\r\n').partition(' ')
+            entry = dict()
+            for fact in facts_found[:-1].split(';'):
+                key, _, value = fact.partition('=')
+                entry[key.lower()] = value
+            content.append((name, entry))
+        return content
+
+    async def retr(self, fpath, callback, blocksize=64 * 1024, rest=None):
+        """
+        Get a file
+        :param fpath: file path on the server
+        :param callback: function called with each received block
+        :param blocksize: maximum size of the received blocks
+        :param rest: restart offset
+        :return:
+        """
+        if not self.binary:
+            await self.command('TYPE I')
+            self.binary = True
+        data_reader, data_writer = await self.__open_data_connection('RETR ' + fpath, rest)
+        try:
+            while True:
+                data = await data_reader.read(blocksize)
+                if not data:
+                    break
+                callback(data)
+        finally:
+            data_writer.close()
+        await self.get_response('2')
+
+    async def close(self):
+        """
+        Quit and close the connection
+        :return:
+        """
+        if self.writer:
+            try:
+                await self.command('QUIT')
+            except Exception:
+                pass
+            self.writer.close()
+            self.writer = None
+
+
+class AsyncQuickFtpClient:
+    """
+    This provides the QuickFtpClient functions with asyncio: several files, from one or several clients, are
+    fetched concurrently from a single event loop.
+    """
+    def __init__(self, _configfile):
+        """
+        Constructor: Read configuration file. The connection is opened at first use.
+        :param _configfile: configuration file
+        """
+        if not _configfile:
+            raise Exception('Missing parameter _configfile')
+
+        self.configfile = os.path.abspath(_configfile)
+        parameters = Helpers.get_param_from_config_file(self.configfile,
+                                                        ['ip', 'port', 'username', 'password', 'workspace'],
+                                                        ['listing_cache_ttl', 'blocksize', 'max_concurrency',
+                                                         'check_after'])
+        self.server_ip = parameters['ip']
+        self.server_port = int(parameters['port'])
+        self.username = parameters['username']
+        self.password = parameters['password']
+        self.workspace = os.path.abspath(parameters['workspace'])
+        self.listing_cache = QuickFtpListingCache(float(parameters.get('listing_cache_ttl', 30)))
+        self.blocksize = int(parameters.get('blocksize', 64 * 1024))
+        self.max_concurrency = int(parameters.get('max_concurrency', 8))
+        self.check_after = float(parameters.get('check_after', 10))
+
+        Helpers.create_dir_if_not_exist(self.workspace)
+
+        self.session = None
+        # (session, last use time) tuples
+        self.__idle_sessions = []
+        # created at first use, within the event loop
+        self.__semaphore = None
+        self.__lock = None
+
+    def __init_primitives(self):
+        """
+        Private function to create the asyncio primitives: the semaphore bounding the concurrent transfers and the
+        lock serializing the commands on the main session.
+        :return:
+        """
+        if self.__lock is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__lock = asyncio.Lock()
+
+    async def __open_session(self):
+        """
+        Private function to open a logged-in session on the server
+        :return: the session
+        """
+        session = AsyncFtpSession(self.server_ip, self.server_port)
+        try:
+            await session.connect(self.username, self.password)
+        except Exception:
+            await session.close()
+            raise Exception('Cannot connect to %s:%d' % (self.server_ip, self.server_port))
+        return session
+
+    async def __connect(self):
+        """
+        Private function to (re)connect the main session
+        :return:
+        """
+        if self.session:
+            await self.session.close()
+        self.session = await self.__open_session()
+
+    async def is_connected(self):
+        """
+        Provides the connection status: connected or not. The first call opens the connection.
+        :return: True is connected
+        """
+        self.__init_primitives()
+        async with self.__lock:
+            try:
+                if not self.session:
+                    await self.__connect()
+                await self.session.pwd()
+            except Exception:
+                return False
+            return True
+
+    async def close(self):
+        """
+        Close all the sessions
+        :return:
+        """
+        for session in [self.session] + [session for session, last_used in self.__idle_sessions]:
+            if session:
+                await session.close()
+        self.session = None
+        # (session, last use time) tuples
+        self.__idle_sessions = []
+
+    @staticmethod
+    def __is_dir_pathname(pathname):
+        """
+        :param pathname: path name
+        :return: True if the path is a directory
+        """
+        return len(pathname) == 0 or pathname.strip()[-1] in ['.', '/']
+
+    async def __list_dir(self, dpath):
+        """
+        Provides the content of a directory, from the listing cache when possible
+        :param dpath: directory path on the server
+        :return: dictionary {name: facts}
+        """
+        content = self.listing_cache.get(dpath)
+        if content is None:
+            logging.debug('list %s', dpath)
+            async with self.__lock:
+                content = dict(await self.session.mlsd(dpath, ['type', 'size', 'modify']))
+            self.listing_cache.set(dpath, content)
+        return content
+
+    async def __get_type(self, fpath):
+        """
+        Provides the type of a file
+        :param fpath: file path
+        :return: 'file', 'dir' or none
+        """
+        if self.__is_dir_pathname(fpath):
+            return 'dir'
+
+        try:
+            facts = (await self.__list_dir(os.path.dirname(fpath))).get(os.path.basename(fpath))
+            if facts:
+                return facts['type']
+            return None
+        except Exception as e:
+            logging.debug(e)
+            return None
+
+    async def is_present(self, fpath):
+        """
+        Provides the presence status of a file: present or not on the server
+        :param fpath: file path
+        :return: True is present
+        """
+        if not await self.is_connected():
+            async with self.__lock:
+                await self.__connect()
+        if await self.__get_type(fpath):
+            return True
+        else:
+            return False
+
+    async def __walk(self, dpath, to):
+        """
+        Private function to enumerate the files of a server directory tree.
+        Local directories are created while walking.
+        :param dpath: directory path on the server
+        :param to: local directory mirroring dpath
+        :return: list of (file path on the server, local directory) tuples
+        """
+        Helpers.create_dir_if_not_exist(to)
+
+        file_list = []
+        for f in await self.__list_dir(dpath):
+            if re.match(r'.*\.(md5|sha256)$', f):
+                continue
+            fpath = os.path.join(dpath, f)
+            type = await self.__get_type(fpath)
+            if type == 'dir':
+                file_list.extend(await self.__walk(fpath, os.path.join(to, f)))
+            elif type == 'file':
+                file_list.append((fpath, to))
+            else:
+                raise Exception('Unable to get type of %s' % fpath)
+        return file_list
+
+    async def __get_file_from_server(self, session, fpath, to, hash_type=None, expected_hash=None):
+        """
+        Private function to get a file from the server, the hash is computed while the data is received.
+        :param session: session to use
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param hash_type: 'md5' or 'sha256'
+        :param expected_hash: expected hash string, None to skip the verification
+        :return: the local file path
+        """
+        dst = os.path.join(to, os.path.basename(fpath))
+        part = dst + '.part'
+        file_hash = Helpers.new_hash(hash_type) if expected_hash else None
+
+        with open(part, 'wb') as file:
+            def write(data):
+                file.write(data)
+                if file_hash:
+                    file_hash.update(data)
+
+            try:
+                logging.debug('get "%s"', fpath)
+                await session.retr(fpath, write, self.blocksize)
+            except (error_temp, OSError, EOFError):
+                # the session is broken, the caller may retry on another one
+                raise
+            except Exception:
+                raise Exception('Unable to get %s file from %s:%d' % (fpath, self.server_ip, self.server_port))
+
+        if file_hash:
+            try:
+                Helpers.check_hash(dst, file_hash.hexdigest(), expected_hash)
+            except Exception:
+                os.remove(part)
+                raise
+
+        os.replace(part, dst)
+        return dst
+
+    async def __acquire_session(self):
+        """
+        Private function to get a session for a transfer: an idle one if any, checked with a NOOP when it was not used
+        for more than check_after seconds, else a new one
+        :return: the session
+        """
+        while self.__idle_sessions:
+            session, last_used = self.__idle_sessions.pop()
+            if time.monotonic() - last_used <= self.check_after:
+                return session
+            try:
+                await session.command('NOOP')
+                return session
+            except Exception:
+                logging.debug('Idle session to %s:%d is closed', self.server_ip, self.server_port)
+                await session.close()
+        return await self.__open_session()
+
+    async def __transfer(self, fpath, to, verify):
+        """
+        Private function to get a single file over a pooled session and optionally verify its signature.
+        A transfer interrupted by a closed session (e.g. by the server timeout) is retried once on a new session.
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param verify: 'md5' or 'sha256'
+        :return: the local file path
+        """
+        async with self.__semaphore:
+            attempt = 0
+            while True:
+                session = await self.__acquire_session()
+                try:
+                    expected_hash = None
+                    if verify:
+                        signature_filename = fpath + '.' + verify
+                        if not await self.__get_type(signature_filename):
+                            raise Exception('No %s found' % signature_filename)
+                        signature_file_path = await self.__get_file_from_server(session, signature_filename, to)
+                        expected_hash = Helpers.read_signature(signature_file_path)
+                    file_path = await self.__get_file_from_server(session, fpath, to, verify, expected_hash)
+                except (error_temp, OSError, EOFError) as e:
+                    await session.close()
+                    attempt += 1
+                    if attempt > 1:
+                        raise Exception('Unable to get %s file from %s:%d' % (fpath, self.server_ip,
+                                                                             self.server_port))
+                    logging.info('Transfer of %s interrupted (%s), retry on a new session', fpath, e)
+                    continue
+                except BaseException:
+                    await session.close()
+                    raise
+                self.__idle_sessions.append((session, time.monotonic()))
+                return file_path
+
+    async def get(self, fpath, to=None, verify=None):
+        """
+        Gets a file from the server, and optionally verify the signature.
+        The files of a directory are fetched concurrently, up to 'max_concurrency' at a time.
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param verify: 'md5' or 'sha256'
+        :return: the local file path
+        """
+        # check arguments
+        if verify and verify not in ['md5', 'sha256']:
+            raise Exception('verify must be md5 or sha256')
+
+        if to:
+            if not os.path.isdir(to):
+                raise Exception('%s is not a directory' % to)
+        else:
+            to = self.workspace
+
+        # Re-connect if needed
+        if not await self.is_connected():
+            logging.info('Not connect, re-connect...')
+            async with self.__lock:
+                await self.__connect()
+
+        fpath = os.path.normpath(fpath)
+        type = await self.__get_type(fpath)
+
+        if type == 'dir':
+            local_dir = os.path.join(to, fpath)
+            file_list = await self.__walk(fpath, local_dir)
+            results = await asyncio.gather(*[self.__transfer(f, local, verify) for f, local in file_list],
+                                           return_exceptions=True)
+            errors = ['%s: %s' % (f, result) for (f, local), result in zip(file_list, results)
+                      if isinstance(result, Exception)]
+            if errors:
+                raise Exception('Unable to get %d file(s): %s' % (len(errors), '; '.join(errors)))
+            return local_dir
+        elif type == 'file':
+            return await self.__transfer(fpath, to, verify)
+        else:
+            raise Exception('Unable to get type of %s' % fpath)
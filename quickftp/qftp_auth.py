@@ -0,0 +1,234 @@
+import os
+import hmac
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class QuickFtpPasswordVerifier:
+    """
+    This checks passwords against stored password hashes. Supported formats:
+    - <md5 hex digest>: legacy unsalted md5, kept for the existing configuration files
+    - pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+    - scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+    Another backend can be plugged in the authorizer: any object with a verify(password, stored) method.
+    """
+    pbkdf2_iterations = 200000
+    scrypt_n = 2 ** 14
+    scrypt_r = 8
+    scrypt_p = 1
+
+    @classmethod
+    def hash_password(cls, password, scheme='pbkdf2_sha256'):
+        """
+        Compute the hash of a password to store in a configuration or users file
+        :param password: password
+        :param scheme: 'pbkdf2_sha256', 'scrypt' or 'md5'
+        :return: the stored password hash
+        """
+        password = password.encode('utf-8')
+        salt = os.urandom(16)
+        if scheme == 'pbkdf2_sha256':
+            digest = hashlib.pbkdf2_hmac('sha256', password, salt, cls.pbkdf2_iterations)
+            return 'pbkdf2_sha256$%d$%s$%s' % (cls.pbkdf2_iterations, salt.hex(), digest.hex())
+        if scheme == 'scrypt':
+            digest = hashlib.scrypt(password, salt=salt, n=cls.scrypt_n, r=cls.scrypt_r, p=cls.scrypt_p)
+            return 'scrypt$%d$%d$%d$%s$%s' % (cls.scrypt_n, cls.scrypt_r, cls.scrypt_p, salt.hex(), digest.hex())
+        if scheme == 'md5':
+            return hashlib.md5(password).hexdigest()
+        raise Exception('Unknown password scheme %s' % scheme)
+
+    @staticmethod
+    def verify(password, stored):
+        """
+        Check a password against a stored password hash, in constant time
+        :param password: password provided by the user
+        :param stored: stored password hash
+        :return: True if the password matches
+        """
+        password = password.encode('utf-8')
+        fields = stored.split('$')
+        try:
+            if fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+                expected = bytes.fromhex(fields[3])
+                digest = hashlib.pbkdf2_hmac('sha256', password, bytes.fromhex(fields[2]), int(fields[1]))
+            elif fields[0] == 'scrypt' and len(fields) == 6:
+                expected = bytes.fromhex(fields[5])
+                digest = hashlib.scrypt(password, salt=bytes.fromhex(fields[4]), n=int(fields[1]),
+                                        r=int(fields[2]), p=int(fields[3]), dklen=len(expected))
+            elif len(fields) == 1:
+                expected = stored.lower().encode('ascii')
+                digest = hashlib.md5(password).hexdigest().encode('ascii')
+            else:
+                logging.error('Unknown password hash format')
+                return False
+        except (ValueError, UnicodeEncodeError):
+            logging.error('Malformed password hash')
+            return False
+        return hmac.compare_digest(digest, expected)
+
+
+class QuickFtpCredentialCache:
+    """
+    This remembers the recently verified credentials, so that a burst of logins of a same user does not compute
+    the slow password hash again and again. Entries are keyed by a HMAC of the user name, password and stored hash
+    with a per-process random key: passwords are never kept in clear, and changing the stored hash of a user
+    invalidates its entries.
+    """
+    def __init__(self, max_size=1024):
+        """
+        Constructor
+        :param max_size: maximum number of entries, least recently used ones are dropped first; 0 disables the cache
+        """
+        self.max_size = max_size
+        self.__key = os.urandom(32)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __digest(self, username, password, stored):
+        """
+        :return: cache key of the credentials
+        """
+        message = '\0'.join([username, password, stored]).encode('utf-8')
+        return hmac.new(self.__key, message, hashlib.sha256).digest()
+
+    def contains(self, username, password, stored):
+        """
+        :param username: user name
+        :param password: password provided by the user
+        :param stored: stored password hash of the user
+        :return: True if these credentials were verified recently
+        """
+        key = self.__digest(username, password, stored)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                return True
+        return False
+
+    def add(self, username, password, stored):
+        """
+        Remember verified credentials
+        :param username: user name
+        :param password: password provided by the user
+        :param stored: stored password hash of the user
+        :return:
+        """
+        if self.max_size <= 0:
+            return
+        key = self.__digest(username, password, stored)
+        with self.__lock:
+            self.__entries[key] = True
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget all the credentials
+        :return:
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+
+class QuickFtpUserTable(dict):
+    """
+    This is the user table of the authorizer: the users added with add_user, then the users of an optional users
+    file. The users file is only read when a user not added with add_user is looked up, and read again once changed,
+    so a large users file does not slow down the server startup. The users file modification time is checked at most
+    every check_interval seconds.
+    Users file format, one user per line: <name> <password hash> <directory relative to the ftp root dir>
+    """
+    check_interval = 1
+
+    def __init__(self, users_file=None, root_dir='.', perm='elr'):
+        """
+        Constructor
+        :param users_file: users file path, None for none
+        :param root_dir: ftp root directory, parent of the users directories
+        :param perm: permissions of the users of the users file
+        """
+        super().__init__()
+        self.users_file = users_file
+        self.root_dir = root_dir
+        self.perm = perm
+        self.__users = dict()
+        self.__entries = dict()
+        self.__mtime = None
+        self.__last_check = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        """
+        Private function to read the users file when it changed since the last read
+        :return:
+        """
+        now = time.monotonic()
+        if self.__last_check is not None and now - self.__last_check < self.check_interval:
+            return
+        self.__last_check = now
+        try:
+            mtime = os.stat(self.users_file).st_mtime_ns
+        except OSError as e:
+            logging.error('Unable to read users file %s: %s', self.users_file, e)
+            return
+        with self.__lock:
+            if mtime == self.__mtime:
+                return
+            users = dict()
+            with open(self.users_file, 'r') as file:
+                for line in file:
+                    fields = line.split()
+                    if not fields or fields[0].startswith('#'):
+                        continue
+                    if len(fields) != 3:
+                        logging.warning('Ignore malformed line of %s', self.users_file)
+                        continue
+                    users[fields[0]] = (fields[1], fields[2])
+            self.__users = users
+            self.__entries = dict()
+            self.__mtime = mtime
+            logging.info('%d users read from %s', len(users), self.users_file)
+
+    def __lookup(self, username):
+        """
+        Private function to get a user of the users file
+        :param username: user name
+        :return: user entry as built by DummyAuthorizer.add_user, None if unknown
+        """
+        if not self.users_file:
+            return None
+        self.__load()
+        entry = self.__entries.get(username)
+        if entry is not None:
+            return entry
+        user = self.__users.get(username)
+        if user is None:
+            return None
+        password, directory = user
+        home = os.path.join(self.root_dir, directory)
+        if not os.path.isdir(home):
+            logging.debug('Create %s', home)
+            os.makedirs(home, exist_ok=True)
+        entry = {'pwd': password, 'home': os.path.realpath(home), 'perm': self.perm, 'operms': {},
+                 'msg_login': 'Login successful.', 'msg_quit': 'Goodbye.'}
+        self.__entries[username] = entry
+        return entry
+
+    def __missing__(self, username):
+        user = self.__lookup(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def __contains__(self, username):
+        return dict.__contains__(self, username) or self.__lookup(username) is not None
+
+    def get(self, username, default=None):
+        try:
+            return self[username]
+        except KeyError:
+            return default
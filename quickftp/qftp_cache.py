@@ -0,0 +1,204 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+class QuickFtpArtifactCache:
+    """
+    This is a content-addressed cache of downloaded files, shared by the clients (and processes) of a host.
+    Files are stored under their server side hash ('<cache dir>/<hash type>/<2 first chars>/<hash>') and materialized
+    in the workspaces by reflink, else hardlink, else copy. Entries are read-only: a hardlinked file must not be
+    modified in place. The cache is bounded in size, the least recently used entries are evicted first.
+    Readers hold a shared lock on the cache directory and the eviction an exclusive one.
+    """
+    def __init__(self, directory, max_size=10 * 1024 ** 3):
+        """
+        Constructor
+        :param directory: cache directory, created if needed
+        :param max_size: maximum size in bytes of the cache, 0 for no limit
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self.__lock_file = os.path.join(self.directory, '.lock')
+        self.__lock = threading.Lock()
+        # size of the cache as known by this process, scanned at the first add() and again when it exceeds max_size
+        self.__size = None
+
+    @contextmanager
+    def __locked(self, operation):
+        """
+        Private function to lock the cache directory
+        :param operation: 'shared' or 'exclusive'
+        :return:
+        """
+        # POSIX only, imported when a cache is used
+        import fcntl
+
+        operation = fcntl.LOCK_SH if operation == 'shared' else fcntl.LOCK_EX
+        with open(self.__lock_file, 'a') as file:
+            fcntl.flock(file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def __path(self, hash_type, file_hash):
+        """
+        Private function to get the path of an entry
+        :param hash_type: 'md5' or 'sha256'
+        :param file_hash: hash of the file
+        :return: the entry path
+        """
+        file_hash = file_hash.lower()
+        if not re.match(r'^[a-z0-9]+$', hash_type) or not re.match(r'^[0-9a-f]{8,}$', file_hash):
+            raise Exception('Invalid hash %s:%s' % (hash_type, file_hash))
+        return os.path.join(self.directory, hash_type, file_hash[:2], file_hash)
+
+    @staticmethod
+    def __clone(src, dst, link=True):
+        """
+        Private function to clone a file: reflink, else hardlink, else copy
+        :param src: source file
+        :param dst: destination file, must not exist
+        :param link: hardlink when reflink is not supported, else copy
+        :return:
+        """
+        import fcntl
+
+        try:
+            with open(src, 'rb') as src_file, open(dst, 'xb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+        if link:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(src, dst)
+
+    @staticmethod
+    def __touch(path):
+        """
+        Private function to record the use of an entry. The time is kept in a '.used' file, not in the entry:
+        hardlinked copies share its modification time.
+        :param path: entry path
+        :return:
+        """
+        with open(path + '.used', 'a'):
+            pass
+        # the current time of the kernel is coarse (a few ms): entries used in a row would have the same time
+        now = time.time_ns()
+        os.utime(path + '.used', ns=(now, now))
+
+    def __entries(self):
+        """
+        Private function to list the entries
+        :return: list of (path, size, last use time)
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                if f.startswith('.') or f.endswith('.used') or f.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    size = os.path.getsize(path)
+                    used = os.path.getmtime(path + '.used') if os.path.exists(path + '.used') \
+                        else os.path.getmtime(path)
+                except OSError:
+                    continue
+                entries.append((path, size, used))
+        return entries
+
+    def materialize(self, hash_type, file_hash, dst, size=None):
+        """
+        Materialize a cached file
+        :param hash_type: 'md5' or 'sha256'
+        :param file_hash: hash of the file
+        :param dst: destination path, replaced if it exists
+        :param size: expected size, None if unknown
+        :return: True if the file was in the cache, else False
+        """
+        path = self.__path(hash_type, file_hash)
+        tmp = '%s.%d.%d.tmp' % (dst, os.getpid(), threading.get_ident())
+        with self.__locked('shared'):
+            try:
+                if size is not None and os.path.getsize(path) != int(size):
+                    logging.warning('Ignore cached %s: size differs from the server one', path)
+                    return False
+                os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                self.__clone(path, tmp)
+                self.__touch(path)
+            except FileNotFoundError:
+                return False
+        os.replace(tmp, dst)
+        logging.debug('%s materialized from %s', dst, path)
+        return True
+
+    def add(self, hash_type, file_hash, fname):
+        """
+        Add a file to the cache, the least recently used entries are evicted when the cache is full.
+        The file must have been verified against the hash. It is copied (or reflinked) into the cache: a hardlink would
+        make the caller's file read-only.
+        :param hash_type: 'md5' or 'sha256'
+        :param file_hash: hash of the file
+        :param fname: file path
+        :return:
+        """
+        path = self.__path(hash_type, file_hash)
+        if os.path.exists(path):
+            return
+        size = os.path.getsize(fname)
+        if self.max_size and size > self.max_size:
+            logging.debug('%s larger than the cache, not cached', fname)
+            return
+
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with self.__locked('shared'):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.__clone(fname, tmp, link=False)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, path)
+            self.__touch(path)
+        with self.__lock:
+            if self.__size is None:
+                self.__size = sum(entry[1] for entry in self.__entries())
+            else:
+                self.__size += size
+            full = self.max_size and self.__size > self.max_size
+        if full:
+            self.evict()
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the cache is 10% under its maximum size
+        :return:
+        """
+        with self.__locked('exclusive'):
+            entries = sorted(self.__entries(), key=lambda entry: entry[2])
+            size = sum(entry[1] for entry in entries)
+            target = self.max_size * 0.9 if self.max_size else size
+            for path, entry_size, used in entries:
+                if size <= target:
+                    break
+                logging.debug('Evict %s from the cache', path)
+                for f in [path, path + '.used']:
+                    try:
+                        os.remove(f)
+                    except FileNotFoundError:
+                        pass
+                size -= entry_size
+        with self.__lock:
+            self.__size = size
@@ -1,16 +1,93 @@
 import os
+import json
+import time
+import zlib
+import calendar
 import logging
-from ftplib import FTP
+import weakref
+import threading
+from ftplib import error_temp, error_perm
+from concurrent.futures import ThreadPoolExecutor
 from quickftp.qftp_helper import Helpers
+from quickftp.qftp_manifest import QuickFtpManifest
+from quickftp.qftp_pool import QuickFtpConnectionPool
+from quickftp.qftp_metrics import QuickFtpMetrics
+from quickftp.qftp_stream import QuickFtpStream
+from quickftp.qftp_cache import QuickFtpArtifactCache
 import re
 
+class QuickFtpListingCache:
+    """
+    This caches the directory listings of the server, keyed by server path.
+    """
+    def __init__(self, ttl):
+        """
+        Constructor
+        :param ttl: time to live of a listing in seconds, 0 disables the cache
+        """
+        self.ttl = ttl
+        self.__listings = dict()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __key(dpath):
+        """
+        :param dpath: directory path on the server
+        :return: normalized directory path
+        """
+        return os.path.normpath(os.path.join('/', dpath))
+
+    def get(self, dpath):
+        """
+        Provides the cached listing of a directory
+        :param dpath: directory path on the server
+        :return: dictionary {name: facts} or None if not cached or expired
+        """
+        key = self.__key(dpath)
+        with self.__lock:
+            try:
+                timestamp, content = self.__listings[key]
+            except KeyError:
+                return None
+            if time.monotonic() - timestamp > self.ttl:
+                del self.__listings[key]
+                return None
+            return content
+
+    def set(self, dpath, content):
+        """
+        Store the listing of a directory
+        :param dpath: directory path on the server
+        :param content: dictionary {name: facts}
+        :return:
+        """
+        if self.ttl > 0:
+            with self.__lock:
+                self.__listings[self.__key(dpath)] = (time.monotonic(), content)
+
+    def invalidate(self, dpath=None):
+        """
+        Drop the listing of a directory, or all the listings
+        :param dpath: directory path on the server, None for all directories
+        :return:
+        """
+        with self.__lock:
+            if dpath is None:
+                self.__listings.clear()
+            else:
+                self.__listings.pop(self.__key(dpath), None)
+
+
 class QuickFtpClient:
     """
     This provides few functions to get a file from a ftp server.
+    Timings and volumes are recorded in the 'metrics' attribute (QuickFtpMetrics): read them with metrics.get(),
+    render them with metrics.render() or follow them with metrics.add_listener().
     """
     def __init__(self, _configfile):
         """
-        Constructor: Read configuration file and try to connect to the server.
+        Constructor: Read configuration file. The connection is opened at first use, from a pool of sessions
+        shared by the clients of a same server and user.
         :param _configfile: configuration file
         """
         if not _configfile:
@@ -18,39 +95,145 @@ class QuickFtpClient:
 
         self.configfile = os.path.abspath(_configfile)
         parameters = Helpers.get_param_from_config_file(self.configfile,
-                                                        ['ip', 'port', 'username','password', 'workspace'])
+                                                        ['ip', 'port', 'username','password', 'workspace'],
+                                                        ['listing_cache_ttl', 'retries', 'retry_delay',
+                                                         'blocksize', 'write_buffer_size', 'pool_min_size',
+                                                         'pool_max_size', 'keepalive', 'check_after',
+                                                         'compression', 'segment_threshold', 'segments',
+                                                         'cache_dir', 'cache_max_size'])
         self.server_ip = parameters['ip']
         self.server_port = int(parameters['port'])
         self.username = parameters['username']
         self.password = parameters['password']
         self.workspace = os.path.abspath(parameters['workspace'])
         self.data_dir = os.path.join(self.workspace,'data')
+        self.listing_cache = QuickFtpListingCache(float(parameters.get('listing_cache_ttl', 30)))
+        self.retries = int(parameters.get('retries', 3))
+        self.retry_delay = float(parameters.get('retry_delay', 1))
+        self.blocksize = int(parameters.get('blocksize', 64 * 1024))
+        self.write_buffer_size = int(parameters.get('write_buffer_size', 1024 * 1024))
+        self.compression = bool(parameters.get('compression', False))
+        self.segment_threshold = int(parameters.get('segment_threshold', 0))
+        self.segments = int(parameters.get('segments', 4))
+        self.cache = None
+        if parameters.get('cache_dir'):
+            self.cache = QuickFtpArtifactCache(parameters['cache_dir'],
+                                               int(parameters.get('cache_max_size', 10 * 1024 ** 3)))
 
         Helpers.create_dir_if_not_exist(self.workspace)
+        self.manifest = QuickFtpManifest(os.path.join(self.workspace, '.quickftp_manifest.json'))
+
+        self.pool = QuickFtpConnectionPool.get_pool(self.server_ip, self.server_port, self.username, self.password,
+                                                    min_size=int(parameters.get('pool_min_size', 0)),
+                                                    max_size=int(parameters.get('pool_max_size', 8)),
+                                                    keepalive=float(parameters.get('keepalive', 0)),
+                                                    check_after=float(parameters.get('check_after', 10)))
+        self.metrics = QuickFtpMetrics()
+        self.__declare_metrics()
+
+        self.ftp = None
+        self.__last_used = 0
+        # support of the XMD5/XSHA256 and XMANIFEST commands by the server, None until known
+        self.__hash_commands = None
+        self.__manifest_command = None
+        self.__release = None
+
+    def __declare_metrics(self):
+        """
+        Private function to declare the client metrics
+        :return:
+        """
+        self.metrics.histogram('quickftp_client_connect_seconds', 'Time to get a logged-in session.')
+        self.metrics.histogram('quickftp_client_listing_seconds', 'Time to list a directory (MLSD, XMANIFEST).')
+        self.metrics.counter('quickftp_client_listing_cache_hits_total', 'Listings served from the cache.')
+        self.metrics.counter('quickftp_client_transfers_total', 'File transfers by result.')
+        self.metrics.counter('quickftp_client_transfer_retries_total', 'Retries of interrupted transfers.')
+        self.metrics.counter('quickftp_client_transfer_bytes_total', 'Bytes written by file transfers.')
+        self.metrics.histogram('quickftp_client_transfer_seconds', 'Duration of file transfers.')
+        self.metrics.histogram('quickftp_client_transfer_throughput_bytes_per_second',
+                               'Throughput of file transfers.', QuickFtpMetrics.throughput_buckets)
+        self.metrics.histogram('quickftp_client_hash_seconds', 'Time spent hashing a file.')
+        self.metrics.counter('quickftp_client_verifications_total', 'Hash verifications by result.')
+        self.metrics.counter('quickftp_client_artifact_cache_total', 'Artifact cache lookups by result.')
+
+    def __enter__(self):
+        return self
 
-        self.ftp = FTP()
-        self.__connect()
+    def __exit__(self, *args):
+        self.close()
 
-    def __connect(self):
+    def __connect(self, ftp=None):
         """
-        Private function to connect to the server
+        Private function to connect to the server: get the main session from the pool, or reconnect a session
+        :param ftp: FTP session to reconnect, the main one by default
         :return:
         """
         try:
-            self.ftp.connect(self.server_ip, self.server_port)
-            self.ftp.login(self.username, self.password)
+            with self.metrics.timer('quickftp_client_connect_seconds'):
+                if ftp is None and self.ftp is None:
+                    # held for the life of the client, not counted against the pool size
+                    self.ftp = self.pool.acquire(held=True)
+                    # give the session back to the pool when the client is closed or garbage collected
+                    self.__release = weakref.finalize(self, self.pool.release, self.ftp, held=True)
+                else:
+                    ftp = ftp or self.ftp
+                    ftp.close()
+                    ftp.connect(self.server_ip, self.server_port)
+                    ftp.login(self.username, self.password)
+                    ftp.transfer_mode = 'S'
         except Exception:
             logging.error('Cannot connect to %s:%d' % (self.server_ip, self.server_port))
 
+    def __ensure_connected(self):
+        """
+        Private function to connect at first use, and to check the main session with a NOOP when it was not used
+        for a while. Recently used sessions are not checked: a broken session is reconnected when an operation fails.
+        :return:
+        """
+        if self.ftp is None:
+            self.__connect()
+        elif time.monotonic() - self.__last_used > self.pool.check_after and not self.pool.is_alive(self.ftp):
+            logging.info('Not connect, re-connect...')
+            self.__connect()
+        if self.ftp is None:
+            raise Exception('Cannot connect to %s:%d' % (self.server_ip, self.server_port))
+        self.__last_used = time.monotonic()
+
+    def close(self):
+        """
+        Give the main session back to the pool
+        :return:
+        """
+        if self.__release:
+            self.__release()
+            self.__release = None
+        self.ftp = None
+
+    def __drop(self):
+        """
+        Private function to close the main session after a failed operation instead of giving it back to the pool:
+        a command or a transfer interrupted by an error may have left replies unread. The next operation gets another
+        session.
+        :return:
+        """
+        if self.__release:
+            self.__release.detach()
+            self.__release = None
+            self.pool.release(self.ftp, discard=True, held=True)
+        self.ftp = None
+
     def is_connected(self):
         """
-        Provides the connection status: connected or not
+        Provides the connection status: connected or not. The first call opens the connection.
         :return: True is connected
         """
+        if self.ftp is None:
+            self.__connect()
         try:
             self.ftp.pwd()
         except Exception:
             return False
+        self.__last_used = time.monotonic()
         return True
 
     def __is_dir_pathname(self, pathname):
@@ -66,75 +249,641 @@ class QuickFtpClient:
                 return True
         return False
 
-    def __get_type(self, fpath):
+    def __set_mode(self, ftp, mode):
+        """
+        Private function to set the transfer mode of a session: 'S' (stream) for listings, 'Z' (zlib compressed
+        stream) for file transfers when compression is enabled. The mode is only sent when it changes.
+        :param ftp: FTP session
+        :param mode: 'S' or 'Z'
+        :return: the mode set
+        """
+        if mode == 'Z' and not self.compression:
+            mode = 'S'
+        if getattr(ftp, 'transfer_mode', 'S') == mode:
+            return mode
+        try:
+            ftp.voidcmd('MODE ' + mode)
+        except error_perm:
+            logging.info('%s:%d does not support MODE %s, compression disabled',
+                         self.server_ip, self.server_port, mode)
+            self.compression = False
+            return self.__set_mode(ftp, 'S')
+        ftp.transfer_mode = mode
+        return mode
+
+    def __list_dir(self, dpath, ftp=None):
+        """
+        Provides the content of a directory, from the listing cache when possible
+        :param dpath: directory path on the server
+        :param ftp: FTP session to use, the main one by default
+        :return: dictionary {name: facts}
+        """
+        content = self.listing_cache.get(dpath)
+        if content is not None:
+            self.metrics.inc('quickftp_client_listing_cache_hits_total')
+            return content
+
+        logging.debug('list %s', dpath)
+        ftp = ftp or self.ftp
+        with self.metrics.timer('quickftp_client_listing_seconds', command='MLSD'):
+            try:
+                self.__set_mode(ftp, 'S')
+                content = dict(ftp.mlsd(dpath, ['type', 'size', 'modify']))
+            except (error_temp, OSError, EOFError) as e:
+                logging.info('Listing of %s failed (%s), re-connect...', dpath, e)
+                self.__connect(ftp)
+                content = dict(ftp.mlsd(dpath, ['type', 'size', 'modify']))
+        self.listing_cache.set(dpath, content)
+        return content
+
+    def __get_type(self, fpath, ftp=None):
         """
         Provides the type of a file
         :param fpath: file path
+        :param ftp: FTP session to use, the main one by default
         :return: 'file', 'dir' or none
         """
         if self.__is_dir_pathname(fpath):
             return 'dir'
 
         try:
-            dir_content = self.ftp.mlsd(os.path.dirname(fpath), ['type'])
-            for entry in dir_content:
-                name, attribute = entry
-                if name == os.path.basename(fpath):
-                    return attribute['type']
+            facts = self.__list_dir(os.path.dirname(fpath), ftp).get(os.path.basename(fpath))
+            if facts:
+                return facts['type']
             return None
         except Exception as e:
             print(e)
             return None
 
-    def __get_content_list(self, dpath):
+    def __get_content_list(self, dpath, ftp=None):
         """
         Get the list of file of a directory
         :param dpath: file path on the server
+        :param ftp: FTP session to use, the main one by default
         :return: filename list of current directory
         """
         logging.debug('get content list of %s', dpath)
         file_list = []
-        dir_content = self.ftp.mlsd(dpath, ['type'])
-        for entry in dir_content:
-            name, tmp = entry
-            if not re.match('.*\.(md5|sha256)$', name):
+        for name in self.__list_dir(dpath, ftp):
+            if not re.match(r'.*\.(md5|sha256)$', name):
                 file_list.append(name)
         return file_list
 
+    def invalidate_cache(self, dpath=None):
+        """
+        Forget the cached listing of a directory, or of all directories
+        :param dpath: directory path on the server, None for all directories
+        :return:
+        """
+        self.listing_cache.invalidate(dpath)
+
     def is_present(self, fpath):
         """
         Provides the presence status of a file: present or not on the server
         :param fpath: file path
         :return: True is present
         """
+        try:
+            self.__ensure_connected()
+        except Exception:
+            return False
+
         if self.__get_type(fpath):
             return True
         else:
             return False
 
-    def __get_file_from_server(self, fpath, to):
+    def __get_resume_offset(self, part, facts):
+        """
+        Private function to get the offset from which a partial download can be resumed.
+        A partial file is only resumed when it is not larger than, and was written after the last change of,
+        the server file.
+        :param part: local partial file path
+        :param facts: server side facts of the file
+        :return: resume offset, 0 to restart from scratch
+        """
+        if not os.path.exists(part):
+            return 0
+        offset = os.path.getsize(part)
+        try:
+            if offset > int(facts['size']):
+                return 0
+            modify = calendar.timegm(time.strptime(facts['modify'][:14], '%Y%m%d%H%M%S'))
+            if os.path.getmtime(part) < modify:
+                return 0
+        except (KeyError, ValueError):
+            return 0
+        return offset
+
+    def __get_file_from_server(self, fpath, to, ftp=None, hash_type=None, expected_hash=None, progress=None,
+                               segments=None):
         """
         Private function to get a file from the server.
+        The file is written in a '.part' file which is renamed once complete. When the transfer is interrupted
+        it is resumed from the end of the '.part' file (REST), after a reconnection and an exponential backoff.
+        When an expected hash is given, the hash is computed while the data is received.
+        With compression, the data is received in MODE Z and decompressed (and hashed) on the fly.
+        Files of at least segment_threshold bytes are fetched in segments over several sessions, then hashed once.
         :param fpath: file path on the server
         :param to: local directory where the file will be copied
+        :param ftp: FTP session to use, the main one by default
+        :param hash_type: 'md5' or 'sha256'
+        :param expected_hash: expected hash string, None to skip the verification
+        :param progress: function called as progress(fpath, bytes received, total bytes, bytes per second)
+        :param segments: number of segments of a large file, the configured one by default
         :return: the local file path
         """
         dst = os.path.join(to, os.path.basename(fpath))
+        part = dst + '.part'
+        ftp = ftp or self.ftp
+        facts = self.__get_facts(fpath, ftp)
 
-        with open(dst, 'wb') as file:
+        start = time.perf_counter()
+        total = int(facts['size']) if 'size' in facts else None
+        # bytes written and time spent hashing, over all the attempts
+        stats = {'bytes': 0, 'hash_seconds': 0.0}
+        segments = self.segments if segments is None else segments
+        segmented = (segments > 1 and self.segment_threshold > 0 and total is not None
+                     and total >= self.segment_threshold and not os.path.exists(part)
+                     and self.__get_segmented(fpath, part, total, ftp, segments, stats, progress))
+        file_hash = None
+        attempt = 0
+        while not segmented:
+            offset = self.__get_resume_offset(part, facts)
+            file_hash = Helpers.new_hash(hash_type) if expected_hash else None
             try:
-                logging.debug('get "%s"', fpath)
-                self.ftp.retrbinary('RETR ' + fpath, file.write)
+                with open(part, 'r+b' if offset else 'wb', buffering=self.write_buffer_size) as file:
+                    if offset and file_hash:
+                        hash_start = time.perf_counter()
+                        for data in iter(lambda: file.read(65536), b""):
+                            file_hash.update(data)
+                        stats['hash_seconds'] += time.perf_counter() - hash_start
+
+                    def write(data):
+                        if decompressor:
+                            data = decompressor.decompress(data)
+                        file.write(data)
+                        stats['bytes'] += len(data)
+                        if file_hash:
+                            hash_start = time.perf_counter()
+                            file_hash.update(data)
+                            stats['hash_seconds'] += time.perf_counter() - hash_start
+                        if progress:
+                            elapsed = time.perf_counter() - start
+                            progress(fpath, file.tell(), total,
+                                     stats['bytes'] / elapsed if elapsed else 0)
+
+                    logging.debug('get "%s" from offset %d', fpath, offset)
+                    file.seek(offset)
+                    decompressor = zlib.decompressobj() if self.__set_mode(ftp, 'Z') == 'Z' else None
+                    ftp.retrbinary('RETR ' + fpath, write, blocksize=self.blocksize, rest=offset or None)
+                    if decompressor and not decompressor.eof:
+                        raise EOFError('Truncated compressed stream')
+                break
+            except (error_temp, OSError, EOFError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    self.metrics.inc('quickftp_client_transfers_total', result='failed')
+                    raise Exception('Unable to get %s file from %s:%d' % (fpath, self.server_ip, self.server_port))
+                self.metrics.inc('quickftp_client_transfer_retries_total')
+                # the first retry is immediate: the session may just have been closed by the server while idle
+                delay = self.retry_delay * 2 ** (attempt - 2) if attempt > 1 else 0
+                logging.warning('Transfer of %s interrupted (%s), retry in %.1f sec', fpath, e, delay)
+                time.sleep(delay)
+                self.__connect(ftp)
             except Exception:
+                self.metrics.inc('quickftp_client_transfers_total', result='failed')
                 raise Exception('Unable to get %s file from %s:%d' % (fpath, self.server_ip, self.server_port))
+
+        elapsed = time.perf_counter() - start
+        self.metrics.inc('quickftp_client_transfers_total', result='completed')
+        self.metrics.inc('quickftp_client_transfer_bytes_total', stats['bytes'])
+        self.metrics.observe('quickftp_client_transfer_seconds', elapsed)
+        if elapsed > 0:
+            self.metrics.observe('quickftp_client_transfer_throughput_bytes_per_second', stats['bytes'] / elapsed)
+
+        if segmented and expected_hash:
+            hash_start = time.perf_counter()
+            computed_hash = Helpers.compute_file_hash(part, hash_type)
+            stats['hash_seconds'] += time.perf_counter() - hash_start
+        else:
+            computed_hash = file_hash.hexdigest() if file_hash else None
+
+        if computed_hash:
+            self.metrics.observe('quickftp_client_hash_seconds', stats['hash_seconds'])
+            try:
+                Helpers.check_hash(dst, computed_hash, expected_hash)
+            except Exception:
+                self.metrics.inc('quickftp_client_verifications_total', result='mismatch')
+                os.remove(part)
+                raise
+            self.metrics.inc('quickftp_client_verifications_total', result='success')
+
+        os.replace(part, dst)
         return dst
 
-    def __get_file(self, fpath, to, verify):
+    def __get_segmented(self, fpath, part, total, ftp, segments, stats, progress=None):
+        """
+        Private function to get a large file in segments fetched concurrently: the first segment over the given
+        session, the others over sessions of the pool. Each segment is received with REST + RETR, written with
+        positional writes in a preallocated '.segments' file, and its transfer is aborted once the segment is complete.
+        An interrupted segment is resumed after a reconnection. The '.segments' file is renamed to the '.part' file
+        once all the segments are complete: a preallocated file is never mistaken for a partial download to resume.
+        :param fpath: file path on the server
+        :param part: local '.part' file
+        :param total: file size
+        :param ftp: FTP session of the first segment
+        :param segments: number of segments
+        :param stats: transfer statistics, 'bytes' is updated
+        :param progress: progress callback
+        :return: True on success, False when the file must be fetched in a single stream
+        """
+        start = time.perf_counter()
+        segment_size = -(-total // segments)
+        ranges = [(offset, min(offset + segment_size, total)) for offset in range(0, total, segment_size)]
+        lock = threading.Lock()
+        segments_file = os.path.splitext(part)[0] + '.segments'
+
+        def get_segment(begin, end, session):
+            fd = os.open(segments_file, os.O_WRONLY)
+            try:
+                position = begin
+                attempt = 0
+                while position < end:
+                    try:
+                        decompressor = zlib.decompressobj() if self.__set_mode(session, 'Z') == 'Z' else None
+                        session.voidcmd('TYPE I')
+                        with session.transfercmd('RETR ' + fpath, rest=position) as conn:
+                            while position < end:
+                                data = conn.recv(self.blocksize)
+                                if not data:
+                                    break
+                                if decompressor:
+                                    data = decompressor.decompress(data)
+                                data = data[:end - position]
+                                os.pwrite(fd, data, position)
+                                position += len(data)
+                                with lock:
+                                    stats['bytes'] += len(data)
+                                    if progress:
+                                        elapsed = time.perf_counter() - start
+                                        progress(fpath, stats['bytes'], total,
+                                                 stats['bytes'] / elapsed if elapsed else 0)
+                        # abort the transfer when the segment ends before the end of the file, then skip the
+                        # replies until the one of NOOP
+                        session.putcmd('ABOR')
+                        session.putcmd('NOOP')
+                        while not session.getmultiline().startswith('200'):
+                            pass
+                        if position < end:
+                            raise EOFError('Segment %d-%d of %s interrupted' % (begin, end, fpath))
+                    except (error_temp, OSError, EOFError) as e:
+                        attempt += 1
+                        if attempt > self.retries:
+                            raise
+                        self.metrics.inc('quickftp_client_transfer_retries_total')
+                        logging.warning('Segment %d-%d of %s interrupted (%s), retry', begin, end, fpath, e)
+                        self.__connect(session)
+            finally:
+                os.close(fd)
+
+        def get_pooled_segment(begin, end):
+            session = self.pool.acquire()
+            try:
+                get_segment(begin, end, session)
+            except BaseException:
+                self.pool.release(session, discard=True)
+                raise
+            self.pool.release(session)
+
+        logging.debug('get "%s" in %d segments', fpath, len(ranges))
+        try:
+            with open(segments_file, 'wb') as file:
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(file.fileno(), 0, total)
+                else:
+                    file.truncate(total)
+            with ThreadPoolExecutor(max_workers=max(1, len(ranges) - 1)) as executor:
+                futures = [executor.submit(get_pooled_segment, begin, end) for begin, end in ranges[1:]]
+                get_segment(ranges[0][0], ranges[0][1], ftp)
+                for future in futures:
+                    future.result()
+            os.replace(segments_file, part)
+        except BaseException as e:
+            if os.path.exists(segments_file):
+                os.remove(segments_file)
+            if not isinstance(e, Exception):
+                raise
+            logging.warning('Segmented transfer of %s failed (%s), get it in a single stream', fpath, e)
+            # the transfer of the first segment may have been interrupted on the session
+            self.__connect(ftp)
+            stats['bytes'] = 0
+            return False
+        return True
+
+    def __walk(self, dpath, to):
+        """
+        Private function to enumerate the files of a server directory tree.
+        Local directories are created while walking.
+        :param dpath: directory path on the server
+        :param to: local directory mirroring dpath
+        :return: list of (file path on the server, local directory) tuples
+        """
+        if not os.path.isdir(to):
+            logging.debug('Create %s', to)
+            os.makedirs(to)
+
+        file_list = []
+        for f in self.__get_content_list(dpath):
+            fpath = os.path.join(dpath, f)
+            type = self.__get_type(fpath)
+            if type == 'dir':
+                file_list.extend(self.__walk(fpath, os.path.join(to, f)))
+            elif type == 'file':
+                file_list.append((fpath, to))
+            else:
+                raise Exception('Unable to get type of %s' % fpath)
+        return file_list
+
+    def __get_facts(self, fpath, ftp=None):
+        """
+        Provides the MLSD facts of a file
+        :param fpath: file path on the server
+        :param ftp: FTP session to use, the main one by default
+        :return: facts dictionary, empty if unknown
+        """
+        try:
+            return self.__list_dir(os.path.dirname(fpath), ftp).get(os.path.basename(fpath)) or dict()
+        except Exception:
+            return dict()
+
+    def __get_signature(self, fpath, hash_types, to, ftp=None, required=False):
+        """
+        Private function to get the signature of a file.
+        The hash is taken from the server manifest when known, else asked to the server (XMD5/XSHA256 commands),
+        which reads it from the signature file or from its checksum index. When the server does not support these
+        commands, the signature file is downloaded.
+        :param fpath: file path on the server
+        :param hash_types: accepted hash types, by order of preference
+        :param to: local directory where the signature file will be copied
+        :param ftp: FTP session to use, the main one by default
+        :param required: ask the server even when there is no signature file
+        :return: (hash type, expected hash) or (None, None)
+        """
+        # hashes already known from the server manifest
+        facts = self.__get_facts(fpath, ftp)
+        for hash_type in hash_types:
+            if facts.get(hash_type):
+                return hash_type, facts[hash_type]
+
+        ftp = ftp or self.ftp
+        for hash_type in hash_types:
+            signature_filename = fpath + '.' + hash_type
+            present = self.__get_type(signature_filename, ftp)
+            if self.__hash_commands is not False and (present or required):
+                command = 'X%s %s' % (hash_type.upper(), fpath)
+                try:
+                    try:
+                        file_hash = ftp.sendcmd(command)[4:].strip()
+                    except (error_temp, OSError, EOFError) as e:
+                        logging.info('%s failed (%s), re-connect...', command, e)
+                        self.__connect(ftp)
+                        file_hash = ftp.sendcmd(command)[4:].strip()
+                    self.__hash_commands = True
+                    return hash_type, file_hash
+                except error_perm as e:
+                    if str(e)[:3] in ['500', '502']:
+                        logging.debug('%s:%d does not support hash commands', self.server_ip, self.server_port)
+                        self.__hash_commands = False
+            if present:
+                signature_file_path = self.__get_file_from_server(signature_filename, to, ftp)
+                return hash_type, Helpers.read_signature(signature_file_path)
+        return None, None
+
+    def __is_synchronized(self, local_path, facts, signature):
+        """
+        Private function to check that a local file is an up-to-date copy of the server file.
+        A local file unknown to the manifest is adopted when it matches the server signature.
+        :param local_path: local file path
+        :param facts: server side facts of the file
+        :param signature: server side signature ('<hash type>:<hash>') or None
+        :return: True if the file does not need to be transferred
+        """
+        if self.manifest.is_up_to_date(local_path, facts, signature):
+            return True
+
+        if signature and os.path.isfile(local_path) and str(os.path.getsize(local_path)) == facts.get('size'):
+            hash_type, expected_hash = signature.split(':', 1)
+            with self.metrics.timer('quickftp_client_hash_seconds'):
+                local_hash = Helpers.compute_file_hash(local_path, hash_type)
+            if local_hash == expected_hash:
+                self.manifest.update(local_path, facts, signature)
+                return True
+        return False
+
+    def __get_manifest(self, dpath):
+        """
+        Private function to get the manifest of a directory tree in a single request (XMANIFEST command).
+        The listing cache is filled with the manifest content.
+        :param dpath: directory path on the server
+        :return: list of manifest entries, None if the server does not support the command
+        """
+        if self.__manifest_command is False:
+            return None
+
+        lines = []
+        try:
+            with self.metrics.timer('quickftp_client_listing_seconds', command='XMANIFEST'):
+                try:
+                    self.__set_mode(self.ftp, 'S')
+                    self.ftp.retrlines('XMANIFEST ' + dpath, lines.append)
+                except (error_temp, OSError, EOFError) as e:
+                    logging.info('Manifest of %s failed (%s), re-connect...', dpath, e)
+                    self.__connect(self.ftp)
+                    lines = []
+                    self.ftp.retrlines('XMANIFEST ' + dpath, lines.append)
+        except error_perm as e:
+            if str(e)[:3] in ['500', '502']:
+                logging.debug('%s:%d does not support manifest command', self.server_ip, self.server_port)
+                self.__manifest_command = False
+                return None
+            raise
+        self.__manifest_command = True
+
+        entries = [json.loads(line) for line in lines]
+        listings = {dpath: dict()}
+        for entry in entries:
+            parent, name = os.path.split(os.path.join(dpath, entry['path']))
+            listings.setdefault(parent, dict())[name] = dict((key, value) for key, value in entry.items()
+                                                             if key != 'path')
+            if entry['type'] == 'dir':
+                listings.setdefault(os.path.join(dpath, entry['path']), dict())
+        for directory, content in listings.items():
+            self.listing_cache.set(directory, content)
+        return entries
+
+    def __plan(self, dpath, to):
+        """
+        Private function to enumerate the files of a server directory tree, from the server manifest when supported,
+        else by walking the tree. Local directories are created.
+        :param dpath: directory path on the server
+        :param to: local directory mirroring dpath
+        :return: list of (file path on the server, local directory) tuples
+        """
+        entries = self.__get_manifest(dpath)
+        if entries is None:
+            return self.__walk(dpath, to)
+
+        Helpers.create_dir_if_not_exist(to)
+        file_list = []
+        for entry in entries:
+            if entry['type'] == 'dir':
+                Helpers.create_dir_if_not_exist(os.path.join(to, entry['path']))
+            elif entry['type'] == 'file' and not re.match(r'.*\.(md5|sha256)$', entry['path']):
+                file_list.append((os.path.join(dpath, entry['path']),
+                                  os.path.join(to, os.path.dirname(entry['path']))))
+        return file_list
+
+    def __transfer(self, fpath, to, verify, ftp=None, sync=False, progress=None, segments=None):
+        """
+        Private function to get a single file and optionally verify its signature.
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param verify: 'md5' or 'sha256'
+        :param ftp: FTP session to use, the main one by default
+        :param sync: skip the transfer if the local file is already up to date
+        :param progress: progress callback of the transfer
+        :param segments: number of segments of a large file, the configured one by default
+        :return: the local file path
+        """
+        hash_type = None
+        expected_hash = None
+        signature = None
+        if verify or sync or self.cache:
+            hash_type, expected_hash = self.__get_signature(fpath, [verify] if verify else ['md5', 'sha256'], to, ftp,
+                                                            required=bool(verify))
+            if expected_hash:
+                signature = '%s:%s' % (hash_type, expected_hash)
+            elif verify:
+                raise Exception('No %s found' % (fpath + '.' + verify))
+
+        if sync:
+            local_path = os.path.join(to, os.path.basename(fpath))
+            facts = self.__get_facts(fpath, ftp)
+            if self.__is_synchronized(local_path, facts, signature):
+                logging.debug('%s is up to date', local_path)
+                return local_path
+            self.manifest.remove(local_path)
+
+        file_path = None
+        if self.cache and expected_hash:
+            file_path = self.__get_file_from_cache(fpath, to, hash_type, expected_hash, ftp)
+        if file_path is None:
+            # files entering the cache are always verified
+            cached = self.cache is not None and expected_hash is not None
+            file_path = self.__get_file_from_server(fpath, to, ftp, hash_type,
+                                                    expected_hash if verify or cached else None, progress, segments)
+            if cached:
+                try:
+                    self.cache.add(hash_type, expected_hash, file_path)
+                except Exception as e:
+                    logging.warning('Unable to cache %s: %s', fpath, e)
+
+        if sync:
+            self.manifest.update(file_path, facts, signature)
+        return file_path
+
+    def __get_file_from_cache(self, fpath, to, hash_type, expected_hash, ftp=None):
+        """
+        Private function to get a file from the artifact cache
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param hash_type: 'md5' or 'sha256'
+        :param expected_hash: server side hash of the file
+        :param ftp: FTP session to use, the main one by default
+        :return: the local file path, None if the file is not in the cache
+        """
+        dst = os.path.join(to, os.path.basename(fpath))
+        try:
+            found = self.cache.materialize(hash_type, expected_hash, dst, self.__get_facts(fpath, ftp).get('size'))
+        except Exception as e:
+            logging.warning('Unable to get %s from the cache: %s', fpath, e)
+            found = False
+        self.metrics.inc('quickftp_client_artifact_cache_total', result='hit' if found else 'miss')
+        if found:
+            logging.debug('%s got from the cache', fpath)
+            return dst
+        return None
+
+    def __transfer_all(self, file_list, verify, workers, sync, progress=None):
+        """
+        Private function to get a list of files, spread over several sessions if requested.
+        All the transfers are attempted, errors are reported in the order of file_list.
+        :param file_list: list of (file path on the server, local directory) tuples
+        :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions
+        :param sync: skip the files already up to date
+        :param progress: progress callback of the transfers
+        :return: list of local file paths
+        """
+        if workers == 1 or len(file_list) <= 1:
+            return [self.__transfer(fpath, to, verify, sync=sync, progress=progress) for fpath, to in file_list]
+
+        result = []
+        errors = []
+        for (fpath, to), (local_path, error) in zip(file_list, self.__transfer_each(file_list, verify, workers, sync,
+                                                                                     progress)):
+            if error:
+                errors.append('%s: %s' % (fpath, error))
+            else:
+                result.append(local_path)
+        if errors:
+            raise Exception('Unable to get %d file(s): %s' % (len(errors), '; '.join(errors)))
+        return result
+
+    def __transfer_each(self, file_list, verify, workers, sync, progress=None):
+        """
+        Private function to get a list of files over several sessions of the pool. All the transfers are attempted.
+        :param file_list: list of (file path on the server, local directory) tuples
+        :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions
+        :param sync: skip the files already up to date
+        :param progress: progress callback of the transfers
+        :return: list of (local file path, None) or (None, error) tuples, in the order of file_list
+        """
+        def transfer(fpath, to):
+            ftp = self.pool.acquire()
+            try:
+                # the files are already spread over the sessions of the pool
+                result = self.__transfer(fpath, to, verify, ftp, sync, progress, segments=1)
+            except BaseException:
+                self.pool.release(ftp, discard=True)
+                raise
+            self.pool.release(ftp)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(file_list)))) as executor:
+            futures = [executor.submit(transfer, fpath, to) for fpath, to in file_list]
+
+        result = []
+        for (fpath, to), future in zip(file_list, futures):
+            error = future.exception()
+            if error:
+                logging.error('Unable to get %s: %s', fpath, error)
+                result.append((None, error))
+            else:
+                result.append((future.result(), None))
+        return result
+
+    def __get_file(self, fpath, to, verify, workers, sync, progress=None):
         """
         Private function to get a file.
         :param fpath: file path on the server
         :param to: local directory where the file will be copied
         :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions used for a directory
+        :param sync: skip the files already up to date
+        :param progress: progress callback of the transfers
         :return: the local file path
         """
         logging.debug('get file "%s"' % fpath)
@@ -144,50 +893,184 @@ class QuickFtpClient:
         if type == 'dir':
             logging.debug('%s is a directory' % fpath)
             local_dir = os.path.join(to, fpath)
-            if not os.path.isdir(local_dir):
-                logging.debug('Create %s', local_dir)
-                os.makedirs(local_dir)
-
-            for f in self.__get_content_list(fpath):
-                self.__get_file(os.path.join(fpath, f), local_dir, verify)
-
-            return os.path.join(to, fpath)
+            self.__transfer_all(self.__plan(fpath, local_dir), verify, workers, sync, progress)
+            return local_dir
 
         elif type == 'file':
-            file_path = self.__get_file_from_server(fpath, to)
-
-            if verify:
-                signature_filename = fpath + '.' + verify
-                if self.is_present(signature_filename):
-                    signature_file_path = self.__get_file_from_server(signature_filename, to)
-                    Helpers.verify_signature(file_path, signature_file_path)
-                else:
-                    raise Exception('No %s found' % signature_filename)
-            return file_path
+            return self.__transfer(fpath, to, verify, sync=sync, progress=progress)
         else:
             raise Exception('Unable to get type of %s' % fpath)
 
-    def get(self, fpath, to=None, verify=None):
+    def __check_arguments(self, to, verify, workers):
         """
-        Gets a file from the server, and optionally verify the signature
-        :param fpath: file path on the server
-        :param to: local directory where the file will be copied
+        Private function to check the arguments of get() and get_many()
+        :param to: local directory where the files will be copied
         :param verify: 'md5' or 'sha256'
-        :return: the local file path
+        :param workers: number of parallel sessions
+        :return: the local directory, the workspace by default
         """
-        # check arguments
         if verify and verify not in ['md5', 'sha256']:
             raise Exception('verify must be md5 or sha256')
 
+        if not isinstance(workers, int) or workers < 1:
+            raise Exception('workers must be a positive integer')
+
         if to:
             if not os.path.isdir(to):
                 raise Exception('%s is not a directory' % to)
         else:
             to = self.workspace
+        return to
 
-        # Re-connect if needed
-        if not self.is_connected():
-            logging.info('Not connect, re-connect...')
-            self.__connect()
+    def get(self, fpath, to=None, verify=None, workers=1, sync=False, progress=None):
+        """
+        Gets a file from the server, and optionally verify the signature
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions used to get a directory
+        :param sync: only transfer the files that are new or changed since the last synchronization
+        :param progress: function called as progress(file path, bytes received, total bytes or None, bytes per second)
+                         while files are received, from several threads when workers > 1
+        :return: the local file path
+        """
+        to = self.__check_arguments(to, verify, workers)
+
+        # Connect or re-connect if needed
+        self.__ensure_connected()
+
+        try:
+            return self.__get_file(os.path.normpath(fpath), to, verify, workers, sync, progress)
+        except BaseException:
+            self.__drop()
+            raise
+        finally:
+            if sync:
+                self.manifest.save()
+
+    def get_many(self, paths, to=None, verify=None, workers=1, sync=False, progress=None):
+        """
+        Gets a batch of files and directories from the server. The parent directories are listed once, then the files
+        are transferred largest first over "workers" sessions. A failure does not stop the other transfers.
+        :param paths: list of file or directory paths on the server
+        :param to: local directory where the files will be copied
+        :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions
+        :param sync: only transfer the files that are new or changed since the last synchronization
+        :param progress: progress callback, see get()
+        :return: dictionary {path: {'local_path': local path or None, 'error': error message or None}}
+        """
+        to = self.__check_arguments(to, verify, workers)
+        self.__ensure_connected()
+
+        paths = list(dict.fromkeys(paths))
+        normpaths = dict((path, os.path.normpath(path)) for path in paths)
+
+        # list each parent directory once, over several sessions
+        parents = list(dict.fromkeys(os.path.dirname(fpath) for fpath in normpaths.values()
+                                     if not self.__is_dir_pathname(fpath)))
 
-        return self.__get_file(os.path.normpath(fpath), to, verify)
+        def list_dir(dpath):
+            ftp = self.pool.acquire()
+            try:
+                self.__list_dir(dpath, ftp)
+            except BaseException:
+                self.pool.release(ftp, discard=True)
+                raise
+            self.pool.release(ftp)
+
+        if workers > 1 and len(parents) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(parents))) as executor:
+                # listing errors are reported below, as unknown file types
+                for dpath in parents:
+                    executor.submit(list_dir, dpath)
+
+        results = dict()
+        # (file path on the server, local directory) of each file, with the requested paths it belongs to
+        file_list = dict()
+        for path, fpath in normpaths.items():
+            try:
+                type = self.__get_type(fpath)
+                if type == 'dir':
+                    local_dir = os.path.join(to, fpath)
+                    for item in self.__plan(fpath, local_dir):
+                        file_list.setdefault(item, []).append(path)
+                    results[path] = {'local_path': local_dir, 'error': None}
+                elif type == 'file':
+                    file_list.setdefault((fpath, to), []).append(path)
+                    results[path] = {'local_path': os.path.join(to, os.path.basename(fpath)), 'error': None}
+                else:
+                    logging.error('Unable to get type of %s', fpath)
+                    results[path] = {'local_path': None, 'error': 'Unable to get type of %s' % fpath}
+            except Exception as e:
+                logging.error('Unable to get %s: %s', path, e)
+                results[path] = {'local_path': None, 'error': str(e)}
+                self.__drop()
+                self.__ensure_connected()
+
+        # largest files first, so that they do not end the batch alone on a single session
+        items = sorted(file_list, key=lambda item: -int(self.__get_facts(item[0]).get('size') or 0))
+        try:
+            transfers = self.__transfer_each(items, verify, workers, sync, progress)
+        finally:
+            if sync:
+                self.manifest.save()
+
+        for item, (local_path, error) in zip(items, transfers):
+            if error is None:
+                continue
+            for path in file_list[item]:
+                message = str(error) if item[0] == normpaths[path] else '%s: %s' % (item[0], error)
+                if results[path]['error']:
+                    message = results[path]['error'] + '; ' + message
+                results[path] = {'local_path': None, 'error': message}
+        return results
+
+    def sync(self, fpath, to=None, verify=None, workers=1, progress=None):
+        """
+        Synchronizes a file or directory from the server: only new or changed files are transferred.
+        :param fpath: file path on the server
+        :param to: local directory where the file will be copied
+        :param verify: 'md5' or 'sha256'
+        :param workers: number of parallel sessions used to get a directory
+        :param progress: progress callback, see get()
+        :return: the local file path
+        """
+        return self.get(fpath, to, verify, workers, sync=True, progress=progress)
+
+    def stream(self, fpath, verify=None, progress=None):
+        """
+        Streams a file from the server, without writing it on disk
+        :param fpath: file path on the server
+        :param verify: 'md5' or 'sha256', the hash is verified when the end of the file is read
+        :param progress: progress callback, see get()
+        :return: QuickFtpStream, a read-only file-like object to close after use (or use in a with statement)
+        """
+        if verify and verify not in ['md5', 'sha256']:
+            raise Exception('verify must be md5 or sha256')
+
+        self.__ensure_connected()
+        fpath = os.path.normpath(fpath)
+        if self.__get_type(fpath) != 'file':
+            raise Exception('%s is not a file' % fpath)
+
+        hash_type, expected_hash = None, None
+        if verify:
+            hash_type, expected_hash = self.__get_signature(fpath, [verify], self.workspace, required=True)
+            if not expected_hash:
+                raise Exception('No %s found' % (fpath + '.' + verify))
+        facts = self.__get_facts(fpath)
+
+        ftp = self.pool.acquire()
+        try:
+            decompressor = zlib.decompressobj() if self.__set_mode(ftp, 'Z') == 'Z' else None
+            ftp.voidcmd('TYPE I')
+            conn = ftp.transfercmd('RETR ' + fpath)
+        except BaseException as e:
+            self.pool.release(ftp, discard=True)
+            if not isinstance(e, Exception):
+                raise
+            raise Exception('Unable to get %s file from %s:%d' % (fpath, self.server_ip, self.server_port))
+        return QuickFtpStream(fpath, conn, ftp, self.pool, decompressor,
+                              Helpers.new_hash(hash_type) if expected_hash else None, expected_hash,
+                              self.blocksize, progress, int(facts['size']) if 'size' in facts else None)
@@ -1,14 +1,28 @@
 import os
-import yaml
+import copy
 import logging
+import threading
 from hashlib import md5
 from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from hashlib import file_digest
+except ImportError:
+    # python < 3.11
+    file_digest = None
 
 
 class Helpers:
     """
     This class regroups helper function used by qftp server and client
     """
+    # read buffer size used to hash files
+    hash_buffer_size = 1024 * 1024
+
+    # parsed configuration files, by path: ((modification time, size), content)
+    __config_cache = dict()
+    __config_lock = threading.Lock()
 
     @staticmethod
     def create_dir_if_not_exist(dname):
@@ -19,7 +33,31 @@ class Helpers:
         """
         if not os.path.exists(dname):
             logging.info('Create %s', dname)
-            os.makedirs(dname)
+            os.makedirs(dname, exist_ok=True)
+
+    @staticmethod
+    def __load_config(configfile):
+        """
+        Private function to parse a yaml configuration file, with the C loader when available. The content is cached
+        until the file changes, so that clients created repeatedly do not parse it again.
+        :param configfile: config file path
+        :return: a copy of the file content
+        """
+        configfile = os.path.abspath(configfile)
+        stat = os.stat(configfile)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with Helpers.__config_lock:
+            entry = Helpers.__config_cache.get(configfile)
+        if entry is None or entry[0] != key:
+            # yaml is only needed to read configuration files, imported at first use
+            import yaml
+            logging.info('open %s', configfile)
+            with open(configfile, 'r') as file:
+                content = yaml.load(file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            entry = (key, content)
+            with Helpers.__config_lock:
+                Helpers.__config_cache[configfile] = entry
+        return copy.deepcopy(entry[1])
 
     @staticmethod
     def get_param_from_config_file(configfile, mandatory_parameter_list, optional_parameter_list=[]):
@@ -32,9 +70,7 @@ class Helpers:
         :return: parameter dictionary
         """
         result = dict()
-        logging.info('open %s', configfile)
-        with open(configfile, 'r') as file:
-            yaml_data = yaml.load(file)
+        yaml_data = Helpers.__load_config(configfile)
 
         for param in mandatory_parameter_list:
             logging.debug('Check parameter %s', param)
@@ -62,25 +98,69 @@ class Helpers:
         logger.addHandler(stream_handler)
 
     @staticmethod
-    def compute_file_hash(fname, hash_type):
+    def new_hash(hash_type):
         """
-        Compute an hash fot a given file
-        :param fname: file path
+        Create a hash object
         :param hash_type: 'md5' or 'sha256'
-        :return: the hash string
+        :return: the hash object
         """
         if 'md5' == hash_type:
-            file_hash = md5()
+            return md5()
         elif 'sha256' == hash_type:
-            file_hash = sha256()
+            return sha256()
         else:
             raise Exception('Unknown hash type')
 
+    @staticmethod
+    def compute_file_hash(fname, hash_type):
+        """
+        Compute an hash fot a given file
+        :param fname: file path
+        :param hash_type: 'md5' or 'sha256'
+        :return: the hash string
+        """
+        file_hash = Helpers.new_hash(hash_type)
+
         with open(fname, "rb") as f:
-            for data in iter(lambda: f.read(4096), b""):
-                file_hash.update(data)
+            if os.fstat(f.fileno()).st_size <= Helpers.hash_buffer_size:
+                file_hash.update(f.read())
+                return file_hash.hexdigest()
+
+            if file_digest:
+                return file_digest(f, lambda: file_hash).hexdigest()
+
+            buffer = bytearray(Helpers.hash_buffer_size)
+            view = memoryview(buffer)
+            for size in iter(lambda: f.readinto(buffer), 0):
+                file_hash.update(view[:size])
         return file_hash.hexdigest()
 
+    @staticmethod
+    def compute_files_hash(fnames, hash_type, workers=None):
+        """
+        Compute the hash of several files concurrently
+        :param fnames: list of file paths
+        :param hash_type: 'md5' or 'sha256'
+        :param workers: number of threads, default from ThreadPoolExecutor
+        :return: dictionary {file path: hash string}
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(lambda fname: Helpers.compute_file_hash(fname, hash_type), fnames)
+            return dict(zip(fnames, hashes))
+
+    @staticmethod
+    def read_signature(f_hash_signature_name):
+        """
+        Read the hash stored in a signature file
+        :param f_hash_signature_name: signature file path (ig: 'myfile.md5')
+        :return: the hash string
+        """
+        logging.debug('Read hash from %s' % f_hash_signature_name)
+        with open(f_hash_signature_name, "r") as file:
+            expected_hash = file.readline().rstrip()
+            logging.debug('Expected hash %s' % expected_hash)
+        return expected_hash
+
     @staticmethod
     def verify_signature(fname, f_hash_signature_name):
         """
@@ -94,12 +174,50 @@ class Helpers:
         if hash_type not in ['md5', 'sha256']:
             raise Exception('Unable to get type of ' % f_hash_signature_name)
 
-        logging.debug('Read hash from %s' % f_hash_signature_name)
-        with open(f_hash_signature_name, "r") as file:
-            expected_hash = file.readline().rstrip()
-            logging.debug('Expected hash %s' % expected_hash)
+        expected_hash = Helpers.read_signature(f_hash_signature_name)
 
         file_hash = Helpers.compute_file_hash(fname, hash_type)
+        Helpers.check_hash(fname, file_hash, expected_hash)
+
+    @staticmethod
+    def verify_directory(dname, workers=None):
+        """
+        Verify the signature of every file of a directory tree that has a signature file next to it
+        :param dname: directory path
+        :param workers: number of threads, default from ThreadPoolExecutor
+        :return: list of verified file paths
+        """
+        signatures = dict()
+        for root, dirs, files in os.walk(dname):
+            for f in files:
+                fname, _, hash_type = f.rpartition('.')
+                if hash_type in ['md5', 'sha256'] and fname in files:
+                    signatures[(os.path.join(root, fname), hash_type)] = os.path.join(root, f)
+
+        def verify(key):
+            fname, hash_type = key
+            Helpers.check_hash(fname, Helpers.compute_file_hash(fname, hash_type),
+                               Helpers.read_signature(signatures[key]))
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(key[0], executor.submit(verify, key)) for key in sorted(signatures)]
+        for fname, future in futures:
+            if future.exception():
+                errors.append(str(future.exception()))
+        if errors:
+            raise Exception('%d bad signature(s): %s' % (len(errors), '; '.join(errors)))
+        return sorted(set(fname for fname, hash_type in signatures))
+
+    @staticmethod
+    def check_hash(fname, file_hash, expected_hash):
+        """
+        Verify that the hash computed for a file match with the expected one
+        :param fname: file path (eg: 'myfile')
+        :param file_hash: computed hash string
+        :param expected_hash: expected hash string
+        :return:
+        """
         logging.debug('Computed hash %s' % file_hash)
 
         if file_hash != expected_hash:
@@ -0,0 +1,91 @@
+import io
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+
+class QuickFtpHotFile(io.BytesIO):
+    """
+    This is a read-only file object over the cached content of a file. It has no file descriptor, so it is sent
+    with send() from memory instead of sendfile.
+    """
+    def __init__(self, data, name):
+        """
+        Constructor
+        :param data: content of the file
+        :param name: file path
+        """
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+class QuickFtpHotFileCache:
+    """
+    This keeps the content of small files in memory, so that files downloaded by many clients at once are read from
+    disk once. Entries are checked against the file size and modification time at each access: a changed file is
+    read again. The cache is bounded in size, the least recently used files are evicted first.
+    """
+    def __init__(self, max_size, max_file_size=1024 * 1024, metrics=None):
+        """
+        Constructor
+        :param max_size: maximum size in bytes of the cached content
+        :param max_file_size: size in bytes of the largest file cached
+        :param metrics: QuickFtpMetrics instance updated with the cache hits and size, if any
+        """
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+        self.metrics = metrics
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __count(self, result):
+        """
+        Private function to update the metrics of a lookup
+        :param result: 'hit' or 'miss'
+        :return:
+        """
+        if self.metrics:
+            self.metrics.inc('quickftp_server_hot_cache_total', result=result)
+            self.metrics.set('quickftp_server_hot_cache_bytes', self.size)
+
+    def open(self, fname):
+        """
+        Open a file from the cache, the file is read and cached when it is not
+        :param fname: file path
+        :return: QuickFtpHotFile, None when the file is too large to be cached
+        """
+        stat = os.stat(fname)
+        if stat.st_size > self.max_file_size:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with self.__lock:
+            entry = self.__entries.get(fname)
+            if entry and entry[0] == key:
+                self.__entries.move_to_end(fname)
+                data = entry[1]
+            else:
+                data = None
+        if data is not None:
+            self.__count('hit')
+            return QuickFtpHotFile(data, fname)
+
+        with open(fname, 'rb') as file:
+            data = file.read()
+        with self.__lock:
+            old = self.__entries.pop(fname, None)
+            if old:
+                self.size -= len(old[1])
+            # a file written while read is not cached
+            if len(data) == stat.st_size:
+                self.__entries[fname] = (key, data)
+                self.size += len(data)
+            while self.size > self.max_size:
+                evicted, (evicted_key, evicted_data) = self.__entries.popitem(last=False)
+                logging.debug('Evict %s from the hot file cache', evicted)
+                self.size -= len(evicted_data)
+        self.__count('miss')
+        return QuickFtpHotFile(data, fname)
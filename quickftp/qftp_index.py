@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from quickftp.qftp_helper import Helpers
+
+
+class QuickFtpChecksumIndex:
+    """
+    This keeps the md5 and sha256 hashes of the files of a directory tree, in memory and in a json index file.
+    The index is refreshed incrementally: only files whose size or modification time changed are hashed again.
+    """
+    hash_types = ['md5', 'sha256']
+
+    def __init__(self, root_dir, index_file, workers=None, metrics=None):
+        """
+        Constructor: Read the index file if it exists.
+        :param root_dir: indexed directory
+        :param index_file: index file path
+        :param workers: number of hashing threads, default from ThreadPoolExecutor
+        :param metrics: QuickFtpMetrics where the refresh durations are observed, if any
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.index_file = os.path.abspath(index_file)
+        self.workers = workers
+        self.metrics = metrics
+        self.__entries = dict()
+        self.__index_mtime = None
+        self.__lock = threading.Lock()
+        self.__reload_if_changed()
+
+    def __reload_if_changed(self):
+        """
+        Private function to read the index file when it was written by another process
+        :return:
+        """
+        try:
+            mtime = os.path.getmtime(self.index_file)
+        except OSError:
+            return
+        if mtime == self.__index_mtime:
+            return
+        try:
+            with open(self.index_file, 'r') as file:
+                entries = json.load(file)
+        except Exception as e:
+            logging.warning('Ignore unreadable index %s: %s', self.index_file, e)
+            return
+        with self.__lock:
+            self.__entries = entries
+            self.__index_mtime = mtime
+
+    def __hash_file(self, fname):
+        """
+        Private function to compute all the hashes of a file in a single read
+        :param fname: file path
+        :return: dictionary {hash type: hash string}
+        """
+        hashes = [Helpers.new_hash(hash_type) for hash_type in self.hash_types]
+        buffer = bytearray(Helpers.hash_buffer_size)
+        view = memoryview(buffer)
+        with open(fname, 'rb') as f:
+            for size in iter(lambda: f.readinto(buffer), 0):
+                for file_hash in hashes:
+                    file_hash.update(view[:size])
+        return dict(zip(self.hash_types, [file_hash.hexdigest() for file_hash in hashes]))
+
+    def __is_indexed(self, fname):
+        """
+        :param fname: file path
+        :return: True if the file must be indexed: signature files and the index itself are not
+        """
+        return fname != self.index_file and not re.match(r'.*\.(md5|sha256)$', fname)
+
+    def refresh(self):
+        """
+        Hash the new and changed files of the directory tree, forget the removed ones and save the index file
+        :return:
+        """
+        start = time.monotonic()
+        stats = dict()
+        for root, dirs, files in os.walk(self.root_dir):
+            for f in files:
+                fname = os.path.join(root, f)
+                if self.__is_indexed(fname):
+                    try:
+                        stat = os.stat(fname)
+                    except OSError:
+                        continue
+                    stats[os.path.relpath(fname, self.root_dir)] = (stat.st_size, stat.st_mtime_ns)
+
+        with self.__lock:
+            changed = [path for path, (size, mtime) in stats.items()
+                       if path not in self.__entries
+                       or (self.__entries[path]['size'], self.__entries[path]['mtime']) != (size, mtime)]
+            removed = [path for path in self.__entries if path not in stats]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            hashes = executor.map(lambda path: self.__hash_file(os.path.join(self.root_dir, path)), changed)
+            new_entries = dict()
+            for path, file_hashes in zip(changed, hashes):
+                new_entries[path] = dict(file_hashes, size=stats[path][0], mtime=stats[path][1])
+
+        with self.__lock:
+            self.__entries.update(new_entries)
+            for path in removed:
+                self.__entries.pop(path, None)
+        if changed or removed or not os.path.exists(self.index_file):
+            self.save()
+        elapsed = time.monotonic() - start
+        if self.metrics:
+            self.metrics.observe('quickftp_server_index_refresh_seconds', elapsed)
+        logging.info('Index of %s refreshed in %.1f sec: %d hashed, %d removed',
+                     self.root_dir, elapsed, len(changed), len(removed))
+
+    def save(self):
+        """
+        Write the index file
+        :return:
+        """
+        tmp_fname = self.index_file + '.tmp'
+        with self.__lock:
+            with open(tmp_fname, 'w') as file:
+                json.dump(self.__entries, file)
+            os.replace(tmp_fname, self.index_file)
+            self.__index_mtime = os.path.getmtime(self.index_file)
+
+    def start(self, interval=0):
+        """
+        Refresh the index in a background thread
+        :param interval: seconds between two refreshes, 0 to refresh only once
+        :return:
+        """
+        def refresh_loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logging.error('Unable to refresh index of %s: %s', self.root_dir, e)
+                if not interval:
+                    break
+                time.sleep(interval)
+
+        thread = threading.Thread(target=refresh_loop, daemon=True)
+        thread.start()
+
+    def lookup(self, fname, hash_type, stat=None):
+        """
+        Provides the hash of a file from the index, without hashing it
+        :param fname: file path
+        :param hash_type: 'md5' or 'sha256'
+        :param stat: os.stat() of the file, read when None
+        :return: the hash string, None if the file is not indexed or changed since it was indexed
+        """
+        if hash_type not in self.hash_types:
+            raise Exception('Unknown hash type')
+
+        path = os.path.relpath(os.path.abspath(fname), self.root_dir)
+        stat = stat or os.stat(fname)
+        for attempt in range(2):
+            with self.__lock:
+                entry = self.__entries.get(path)
+            if entry and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime_ns):
+                return entry[hash_type]
+            # the index may have been refreshed by another process
+            self.__reload_if_changed()
+        return None
@@ -0,0 +1,88 @@
+import os
+import json
+import logging
+import threading
+
+
+class QuickFtpManifest:
+    """
+    This keeps track of the files downloaded in a workspace, so that unchanged files are not transferred again.
+    Each local file is recorded with the server side facts (size, modify and signature) it was downloaded with
+    and the local size and modification time it had once written.
+    """
+    def __init__(self, fname):
+        """
+        Constructor: Read the manifest file if it exists.
+        :param fname: manifest file path
+        """
+        self.fname = fname
+        self.__entries = dict()
+        self.__lock = threading.Lock()
+
+        if os.path.exists(self.fname):
+            try:
+                with open(self.fname, 'r') as file:
+                    self.__entries = json.load(file)
+            except Exception as e:
+                logging.warning('Ignore unreadable manifest %s: %s', self.fname, e)
+
+    def is_up_to_date(self, local_path, facts, signature=None):
+        """
+        Check that a local file is an unchanged copy of the server file
+        :param local_path: local file path
+        :param facts: server side facts of the file (MLSD 'size' and 'modify')
+        :param signature: server side signature ('<hash type>:<hash>') or None
+        :return: True if the local file does not need to be transferred
+        """
+        local_path = os.path.abspath(local_path)
+        with self.__lock:
+            entry = self.__entries.get(local_path)
+        if not entry or not facts:
+            return False
+        if entry['size'] != facts.get('size') or entry['modify'] != facts.get('modify'):
+            return False
+        if signature and entry['signature'] != signature:
+            return False
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            return False
+        return stat.st_size == entry['local_size'] and stat.st_mtime_ns == entry['local_mtime']
+
+    def update(self, local_path, facts, signature=None):
+        """
+        Record a local file as an up-to-date copy of a server file
+        :param local_path: local file path
+        :param facts: server side facts of the file (MLSD 'size' and 'modify')
+        :param signature: server side signature ('<hash type>:<hash>') or None
+        :return:
+        """
+        local_path = os.path.abspath(local_path)
+        stat = os.stat(local_path)
+        with self.__lock:
+            self.__entries[local_path] = {'size': facts.get('size'),
+                                          'modify': facts.get('modify'),
+                                          'signature': signature,
+                                          'local_size': stat.st_size,
+                                          'local_mtime': stat.st_mtime_ns}
+
+    def remove(self, local_path):
+        """
+        Forget a local file
+        :param local_path: local file path
+        :return:
+        """
+        with self.__lock:
+            self.__entries.pop(os.path.abspath(local_path), None)
+
+    def save(self):
+        """
+        Write the manifest file
+        :return:
+        """
+        tmp_fname = self.fname + '.tmp'
+        with self.__lock:
+            with open(tmp_fname, 'w') as file:
+                json.dump(self.__entries, file)
+            os.replace(tmp_fname, self.fname)
+        logging.debug('Manifest saved in %s', self.fname)
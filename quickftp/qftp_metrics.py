@@ -0,0 +1,256 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class QuickFtpMetrics:
+    """
+    This keeps counters, gauges and histograms, with labels, and renders them in the Prometheus text format.
+    Metrics are declared first, then updated with inc(), set() and observe(). Listeners are called on each update.
+    """
+    latency_buckets = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+    throughput_buckets = [1e5, 1e6, 1e7, 1e8, 1e9]
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__metrics = dict()
+        self.__listeners = []
+        self.__lock = threading.Lock()
+
+    def __declare(self, name, type, help, buckets=None):
+        """
+        Private function to declare a metric, a metric already declared is kept
+        :return:
+        """
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = {'type': type, 'help': help, 'buckets': buckets, 'values': dict()}
+
+    def counter(self, name, help):
+        """
+        Declare a counter
+        :param name: metric name
+        :param help: metric description
+        :return:
+        """
+        self.__declare(name, 'counter', help)
+
+    def gauge(self, name, help):
+        """
+        Declare a gauge
+        :param name: metric name
+        :param help: metric description
+        :return:
+        """
+        self.__declare(name, 'gauge', help)
+
+    def histogram(self, name, help, buckets=None):
+        """
+        Declare a histogram
+        :param name: metric name
+        :param help: metric description
+        :param buckets: bucket upper bounds, latency_buckets (seconds) by default
+        :return:
+        """
+        self.__declare(name, 'histogram', help, sorted(buckets or self.latency_buckets))
+
+    def add_listener(self, callback):
+        """
+        Register a function called on each update as callback(name, value, labels)
+        :param callback: function
+        :return:
+        """
+        self.__listeners.append(callback)
+
+    def __update(self, name, value, labels, update):
+        """
+        Private function to update the value of a metric
+        :param name: metric name
+        :param value: value given to the update function
+        :param labels: dictionary of labels
+        :param update: function(metric, key, value) applying the value, called with the lock held
+        :return:
+        """
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            try:
+                metric = self.__metrics[name]
+            except KeyError:
+                raise Exception('Unknown metric %s' % name)
+            update(metric, key, value)
+        for callback in self.__listeners:
+            try:
+                callback(name, value, labels)
+            except Exception as e:
+                logging.error('Metrics listener failed: %s', e)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter or a gauge
+        :param name: metric name
+        :param value: increment
+        :param labels: labels of the value
+        :return:
+        """
+        def update(metric, key, value):
+            metric['values'][key] = metric['values'].get(key, 0) + value
+        self.__update(name, value, labels, update)
+
+    def dec(self, name, value=1, **labels):
+        """
+        Decrement a gauge
+        :param name: metric name
+        :param value: decrement
+        :param labels: labels of the value
+        :return:
+        """
+        self.inc(name, -value, **labels)
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge
+        :param name: metric name
+        :param value: value
+        :param labels: labels of the value
+        :return:
+        """
+        def update(metric, key, value):
+            metric['values'][key] = value
+        self.__update(name, value, labels, update)
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram
+        :param name: metric name
+        :param value: observed value
+        :param labels: labels of the value
+        :return:
+        """
+        def update(metric, key, value):
+            histogram = metric['values'].get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0}
+                metric['values'][key] = histogram
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.__update(name, value, labels, update)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the duration of a block in a histogram
+        :param name: histogram name
+        :param labels: labels of the value
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        Provides the value of a metric
+        :param name: metric name
+        :param labels: labels of the value
+        :return: counter or gauge value, {'count': <observations>, 'sum': <sum>} for a histogram, 0 if never updated
+        """
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            value = metric['values'].get(tuple(sorted(labels.items()))) if metric else None
+            if value is None:
+                return {'count': 0, 'sum': 0.0} if metric and metric['type'] == 'histogram' else 0
+            if metric['type'] == 'histogram':
+                return {'count': value['count'], 'sum': value['sum']}
+            return value
+
+    @staticmethod
+    def __format_labels(key, extra=()):
+        """
+        :return: Prometheus labels string
+        """
+        labels = list(key) + list(extra)
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for name, value in labels)
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text format
+        """
+        lines = []
+        with self.__lock:
+            for name, metric in sorted(self.__metrics.items()):
+                lines.append('# HELP %s %s' % (name, metric['help']))
+                lines.append('# TYPE %s %s' % (name, metric['type']))
+                for key, value in sorted(metric['values'].items()):
+                    if metric['type'] != 'histogram':
+                        lines.append('%s%s %s' % (name, self.__format_labels(key), value))
+                        continue
+                    for bound, count in zip(metric['buckets'], value['buckets']):
+                        lines.append('%s_bucket%s %d' % (name, self.__format_labels(key, [('le', bound)]), count))
+                    lines.append('%s_bucket%s %d' % (name, self.__format_labels(key, [('le', '+Inf')]),
+                                                     value['count']))
+                    lines.append('%s_sum%s %s' % (name, self.__format_labels(key), value['sum']))
+                    lines.append('%s_count%s %d' % (name, self.__format_labels(key), value['count']))
+        return '\n'.join(lines) + '\n'
+
+
+class QuickFtpMetricsServer:
+    """
+    This serves metrics in the Prometheus text format over HTTP (GET /metrics), from a background thread.
+    """
+    def __init__(self, metrics, ip, port):
+        """
+        Constructor
+        :param metrics: QuickFtpMetrics instance
+        :param ip: listening address
+        :param port: listening port
+        """
+        # only the processes serving metrics need the http server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = self.metrics.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logging.debug('metrics: ' + format, *args)
+
+        self.http_server = ThreadingHTTPServer((ip, port), Handler)
+        self.http_server.daemon_threads = True
+
+    def start(self):
+        """
+        Serve the metrics in a background thread
+        :return:
+        """
+        logging.info('Metrics on http://%s:%d/metrics', *self.http_server.server_address[:2])
+        thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        thread.start()
+
+    def close(self):
+        """
+        Stop serving the metrics
+        :return:
+        """
+        self.http_server.shutdown()
+        self.http_server.server_close()
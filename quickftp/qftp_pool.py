@@ -0,0 +1,211 @@
+import time
+import logging
+import threading
+from ftplib import FTP
+
+
+class QuickFtpConnectionPool:
+    """
+    This shares logged-in FTP sessions between the clients of a same server and user.
+    Sessions used for an operation count against max_size. Sessions held by a client for its whole life (held
+    sessions) do not: they would limit the number of live clients. Sessions are opened on demand, idle sessions are
+    checked with a NOOP only when they were not used for a while and, when a keepalive period is set, idle sessions
+    are kept alive by a background thread.
+    """
+    __pools = dict()
+    __pools_lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, ip, port, username, password, **options):
+        """
+        Provides the pool of a server and user, created at first call
+        :param ip: server address
+        :param port: server port
+        :param username: user name
+        :param password: password
+        :param options: constructor options, only used when the pool is created
+        :return: the pool
+        """
+        key = (ip, port, username)
+        with cls.__pools_lock:
+            pool = cls.__pools.get(key)
+            if pool is None:
+                pool = cls(ip, port, username, password, **options)
+                cls.__pools[key] = pool
+            pool.password = password
+            return pool
+
+    def __init__(self, ip, port, username, password, min_size=0, max_size=8, keepalive=0, check_after=10,
+                 timeout=60):
+        """
+        Constructor
+        :param ip: server address
+        :param port: server port
+        :param username: user name
+        :param password: password
+        :param min_size: number of sessions kept open by the keepalive thread
+        :param max_size: maximum number of sessions, idle or in use, held sessions excepted
+        :param keepalive: period in seconds of the NOOP sent to idle sessions, 0 disables the keepalive thread
+        :param check_after: idle time in seconds after which a session is checked before being reused
+        :param timeout: maximum time in seconds to wait for a session when max_size sessions are in use
+        """
+        self.ip = ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.min_size = min_size
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self.check_after = check_after
+        self.timeout = timeout
+
+        self.__idle = []
+        self.__size = 0
+        self.__condition = threading.Condition()
+
+        if self.keepalive > 0:
+            thread = threading.Thread(target=self.__keepalive_loop, daemon=True)
+            thread.start()
+
+    def __open(self):
+        """
+        Private function to open a logged-in session
+        :return: the FTP session
+        """
+        ftp = FTP()
+        try:
+            ftp.connect(self.ip, self.port)
+            ftp.login(self.username, self.password)
+        except Exception:
+            ftp.close()
+            raise Exception('Cannot connect to %s:%d' % (self.ip, self.port))
+        return ftp
+
+    @staticmethod
+    def is_alive(ftp):
+        """
+        Check a session with a NOOP
+        :param ftp: FTP session
+        :return: True if the session answered
+        """
+        try:
+            ftp.voidcmd('NOOP')
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def __close(ftp):
+        """
+        Private function to close a session
+        :param ftp: FTP session
+        :return:
+        """
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def acquire(self, held=False):
+        """
+        Get a session for exclusive use: an idle one if any, else a new one
+        :param held: the session is held for the life of a client: it is not counted against max_size and never
+        waits for a session to be released
+        :return: the FTP session
+        """
+        with self.__condition:
+            while not held and not self.__idle and self.__size >= self.max_size:
+                if not self.__condition.wait(self.timeout):
+                    raise Exception('No session available to %s:%d: %d sessions in use for %d seconds'
+                                    % (self.ip, self.port, self.max_size, self.timeout))
+            if self.__idle:
+                ftp, last_used = self.__idle.pop()
+                if held:
+                    self.__size -= 1
+                    self.__condition.notify()
+            else:
+                ftp, last_used = None, None
+                if not held:
+                    self.__size += 1
+
+        try:
+            if ftp is None:
+                logging.debug('Open a new session to %s:%d', self.ip, self.port)
+                return self.__open()
+            if time.monotonic() - last_used > self.check_after and not self.is_alive(ftp):
+                logging.debug('Idle session to %s:%d is closed, re-open', self.ip, self.port)
+                ftp.close()
+                return self.__open()
+            return ftp
+        except Exception:
+            if not held:
+                with self.__condition:
+                    self.__size -= 1
+                    self.__condition.notify()
+            raise
+
+    def release(self, ftp, discard=False, held=False):
+        """
+        Give back a session obtained with acquire
+        :param ftp: FTP session
+        :param discard: close the session instead of keeping it for reuse
+        :param held: the session was acquired as a held session, it is closed when the pool is full
+        :return:
+        """
+        with self.__condition:
+            if held and not discard:
+                # a held session joins the sessions counted against max_size, if there is room for it
+                discard = self.__size >= self.max_size
+                if not discard:
+                    self.__size += 1
+            if discard:
+                if not held:
+                    self.__size -= 1
+            else:
+                self.__idle.append((ftp, time.monotonic()))
+            self.__condition.notify()
+        if discard:
+            self.__close(ftp)
+
+    def __keepalive_loop(self):
+        """
+        Private function run by the keepalive thread: send a NOOP on sessions idle for more than the keepalive
+        period and open sessions up to min_size.
+        :return:
+        """
+        while True:
+            time.sleep(self.keepalive)
+            now = time.monotonic()
+            with self.__condition:
+                expired = [entry for entry in self.__idle if now - entry[1] >= self.keepalive]
+                self.__idle = [entry for entry in self.__idle if now - entry[1] < self.keepalive]
+                missing = max(0, self.min_size - self.__size)
+                self.__size += missing
+
+            for ftp, last_used in expired:
+                if self.is_alive(ftp):
+                    self.release(ftp)
+                else:
+                    logging.debug('Drop closed session to %s:%d', self.ip, self.port)
+                    self.release(ftp, discard=True)
+
+            for i in range(missing):
+                try:
+                    ftp = self.__open()
+                except Exception as e:
+                    logging.debug(e)
+                    with self.__condition:
+                        self.__size -= 1
+                    continue
+                self.release(ftp)
+
+    def close(self):
+        """
+        Close the idle sessions
+        :return:
+        """
+        with self.__condition:
+            idle = self.__idle
+            self.__idle = []
+        for ftp, last_used in idle:
+            self.release(ftp, discard=True)
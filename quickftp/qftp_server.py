@@ -1,34 +1,470 @@
 import os
-from hashlib import md5
+import json
+import time
+import zlib
+import socket
+import threading
+import multiprocessing
 import logging
 from quickftp.qftp_helper import Helpers
+from quickftp.qftp_auth import QuickFtpPasswordVerifier, QuickFtpCredentialCache, QuickFtpUserTable
+from quickftp.qftp_index import QuickFtpChecksumIndex
+from quickftp.qftp_throttle import QuickFtpTokenBucket, QuickFtpThrottledDTP
+from quickftp.qftp_metrics import QuickFtpMetrics, QuickFtpMetricsServer
+from quickftp.qftp_hot_cache import QuickFtpHotFileCache
 
 from pyftpdlib.authorizers import DummyAuthorizer, AuthenticationFailed
 from pyftpdlib.handlers import FTPHandler
 from pyftpdlib.handlers import TLS_FTPHandler
-from pyftpdlib.servers import FTPServer
+from pyftpdlib.servers import FTPServer, ThreadedFTPServer
+from pyftpdlib.ioloop import IOLoop
+try:
+    from pyftpdlib.handlers import FileProducer, BufferedIteratorProducer
+except ImportError:
+    # pyftpdlib >= 2
+    from pyftpdlib.handlers.ftp.producers import FileProducer, BufferedIteratorProducer
+from pyftpdlib.exceptions import FilesystemError
 
 
 class QuickFtpAuthorizer(DummyAuthorizer):
     """
     This class is user to check user password.
+    Stored passwords are hashes checked by a pluggable verifier (QuickFtpPasswordVerifier by default), and recently
+    verified credentials are kept in a bounded LRU cache so that login bursts do not recompute slow hashes.
     """
+    def __init__(self, verifier=None, cache_size=1024, users_file=None, root_dir='.'):
+        """
+        Constructor
+        :param verifier: password verifier, object with a verify(password, stored) method
+        :param cache_size: number of verified credentials kept in cache, 0 disables the cache
+        :param users_file: file of additional users, read at the first login of a user not added with add_user
+                           (see QuickFtpUserTable)
+        :param root_dir: ftp root directory, parent of the users directories of the users file
+        """
+        super().__init__()
+        self.verifier = verifier or QuickFtpPasswordVerifier()
+        self.credential_cache = QuickFtpCredentialCache(cache_size)
+        self.user_table = QuickFtpUserTable(users_file, root_dir)
+
+    def has_user(self, username):
+        """
+        Whether a user was added with add_user. The users file is not read, so adding the users of the configuration
+        file does not read it, and a user defined in both is not a duplicate: the configuration file entry wins.
+        :param username: user name
+        :return: True if the user was added with add_user
+        """
+        return dict.__contains__(self.user_table, username)
+
     def validate_authentication(self, username, password, handler):
         """
-        Compute md5 of password provided by the user and compare with the local one.
+        Check the password provided by the user against the stored password hash, in constant time.
         :param username: user name
         :param password: password provided by the user
         :param handler: FTP handler
         :return:
         """
-        password = password.encode('utf-8')
-        hash_md5 = md5(password).hexdigest()
-        logging.debug("Check %s's password %s hash %s", username, password, hash_md5)
+        logging.debug("Check %s's password", username)
         try:
-            if self.user_table[username]['pwd'] != hash_md5:
-                raise KeyError
+            stored = self.user_table[username]['pwd']
         except KeyError:
             raise AuthenticationFailed
+        if self.credential_cache.contains(username, password, stored):
+            return
+        if not self.verifier.verify(password, stored):
+            raise AuthenticationFailed
+        self.credential_cache.add(username, password, stored)
+
+
+class QuickFtpZlibProducer:
+    """
+    This producer compresses the data of another producer in a zlib stream (MODE Z).
+    For file transfers, it also stands for the file object of the data channel: it has no fileno() so that the file
+    is not sent with sendfile, and it closes the file at the end of the transfer.
+    """
+    def __init__(self, producer, level, file=None):
+        """
+        Constructor
+        :param producer: producer of the data to compress
+        :param level: zlib compression level, 0 to store the data without compressing it
+        :param file: file object of the transfer, if any
+        """
+        self.producer = producer
+        self.file = file
+        self.__compressor = zlib.compressobj(level)
+        self.__done = False
+
+    @property
+    def name(self):
+        return self.file.name
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def close(self):
+        self.file.close()
+
+    def more(self):
+        """
+        :return: the next chunk of compressed data, empty at the end of the stream
+        """
+        while not self.__done:
+            data = self.producer.more()
+            if not data:
+                self.__done = True
+                return self.__compressor.flush()
+            data = self.__compressor.compress(data)
+            if data:
+                return data
+        return b''
+
+
+class QuickFtpCommands:
+    """
+    This mixin adds quickftp commands to the pyftpdlib handlers:
+    - XMD5 <file>, XSHA256 <file>: reply the hash of a file, read from its signature file (.md5 or .sha256) when
+      present, else from the checksum index when the server maintains one and the file is indexed.
+    - XMANIFEST [<directory>]: send over the data channel the manifest of a directory tree, one json object per
+      line with the relative 'path', the 'type' ('file' or 'dir'), the 'size' and 'modify' facts (as in MLSD)
+      and the 'md5'/'sha256' hashes known from signature files or from the checksum index.
+    - MODE Z: compress the data channel with zlib when the server enables compression. Files smaller than
+      compression_min_size or with an extension of compression_skip_extensions (already compressed data) are
+      sent in stored zlib blocks.
+    It also limits the number of concurrent sessions of a user to the 'max_connections' of the user, updates the
+    server metrics (connections, logins, commands and transfers) when a QuickFtpMetrics instance is set, and serves
+    small files from memory when a QuickFtpHotFileCache is set.
+    """
+    checksum_index = None
+    hot_cache = None
+    user_sessions = None
+    metrics = None
+
+    __sessions_lock = threading.Lock()
+
+    compression = False
+    compression_level = 6
+    compression_min_size = 4096
+    compression_skip_extensions = ['.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.rar',
+                                   '.jpg', '.jpeg', '.png', '.gif', '.mp3', '.mp4']
+    transfer_mode = 'S'
+
+    commands = {
+        'XMD5': dict(perm='r', auth=True, arg=True, help='Syntax: XMD5 <SP> file-name (get md5 of file).'),
+        'XSHA256': dict(perm='r', auth=True, arg=True, help='Syntax: XSHA256 <SP> file-name (get sha256 of file).'),
+        'XMANIFEST': dict(perm='l', auth=True, arg=None,
+                          help='Syntax: XMANIFEST [<SP> dir-name] (list a directory tree with hashes).'),
+    }
+
+    def __init__(self, conn, server, ioloop=None):
+        super().__init__(conn, server, ioloop=ioloop)
+        # the server swaps the authorizer of the handler class when its configuration is reloaded:
+        # the session keeps the one it was opened with
+        self.authorizer = self.authorizer
+        self.__session_user = None
+        self.__connected = False
+
+    def on_connect(self):
+        """
+        Count the new connection
+        :return:
+        """
+        super().on_connect()
+        if self.metrics:
+            self.__connected = True
+            self.metrics.inc('quickftp_server_connections_total')
+            self.metrics.inc('quickftp_server_sessions')
+
+    def process_command(self, cmd, *args, **kwargs):
+        """
+        Run a command, its duration is observed in the metrics
+        :param cmd: command
+        :return:
+        """
+        if not self.metrics:
+            return super().process_command(cmd, *args, **kwargs)
+        with self.metrics.timer('quickftp_server_command_seconds', command=cmd):
+            return super().process_command(cmd, *args, **kwargs)
+
+    def handle_auth_failed(self, msg, password):
+        """
+        Count the failed login and reply after a delay
+        :param msg: error message
+        :param password: password provided by the user
+        :return:
+        """
+        if self.metrics:
+            self.metrics.inc('quickftp_server_logins_total', result='failure')
+        super().handle_auth_failed(msg, password)
+
+    def log_transfer(self, cmd, filename, receive, completed, elapsed, bytes):
+        """
+        Log a file transfer and update the transfer metrics
+        :param cmd: command
+        :param filename: file path
+        :param receive: True for uploads
+        :param completed: True if the file was entirely transferred
+        :param elapsed: transfer duration in seconds
+        :param bytes: number of bytes transferred
+        :return:
+        """
+        super().log_transfer(cmd, filename, receive, completed, elapsed, bytes)
+        if self.metrics:
+            self.metrics.inc('quickftp_server_transfers_total', command=cmd,
+                             result='completed' if completed else 'aborted')
+            self.metrics.inc('quickftp_server_transfer_bytes_total', bytes, command=cmd)
+            self.metrics.observe('quickftp_server_transfer_seconds', elapsed, command=cmd)
+            if completed and elapsed > 0:
+                self.metrics.observe('quickftp_server_transfer_throughput_bytes_per_second', bytes / elapsed,
+                                     command=cmd)
+
+    def handle_auth_success(self, home, password, msg_login):
+        """
+        Log the user in, unless the user already has 'max_connections' sessions
+        :param home: home directory of the user
+        :param password: password provided by the user
+        :param msg_login: login message
+        :return:
+        """
+        if self.user_sessions is not None:
+            limit = self.authorizer.user_table[self.username].get('max_connections')
+            with self.__sessions_lock:
+                count = self.user_sessions.get(self.username, 0)
+                if limit and count >= limit:
+                    count = None
+                else:
+                    self.user_sessions[self.username] = count + 1
+                    self.__session_user = self.username
+            if count is None:
+                if self.metrics:
+                    self.metrics.inc('quickftp_server_logins_total', result='rejected')
+                self.respond('421 Too many connections for this user.')
+                self.close_when_done()
+                return
+        if self.metrics:
+            self.metrics.inc('quickftp_server_logins_total', result='success')
+        super().handle_auth_success(home, password, msg_login)
+
+    def __release_session(self):
+        """
+        Private function to stop counting the session in the sessions of its user
+        :return:
+        """
+        if self.__session_user is not None:
+            with self.__sessions_lock:
+                self.user_sessions[self.__session_user] -= 1
+            self.__session_user = None
+
+    def flush_account(self):
+        """
+        Log the user out (REIN, USER)
+        :return:
+        """
+        self.__release_session()
+        super().flush_account()
+
+    def close(self):
+        """
+        Close the session
+        :return:
+        """
+        self.__release_session()
+        if self.__connected:
+            self.__connected = False
+            self.metrics.dec('quickftp_server_sessions')
+        super().close()
+
+    def __reply_hash(self, path, hash_type):
+        """
+        Private function to reply the hash of a file
+        :param path: file path on the file system
+        :param hash_type: 'md5' or 'sha256'
+        :return: the file path on success, else None
+        """
+        try:
+            if self.fs.isfile(path + '.' + hash_type):
+                file_hash = self.run_as_current_user(Helpers.read_signature, path + '.' + hash_type)
+            elif self.checksum_index and self.fs.isfile(path):
+                # files are hashed by the index refreshes, never while serving the command
+                file_hash = self.run_as_current_user(self.checksum_index.lookup, path, hash_type)
+                if file_hash is None:
+                    self.respond('550 %s not indexed yet.' % hash_type)
+                    return None
+            else:
+                self.respond('550 No %s signature.' % hash_type)
+                return None
+        except (OSError, FilesystemError) as err:
+            self.respond('550 %s.' % (getattr(err, 'strerror', None) or err))
+            return None
+        self.respond('250 %s' % file_hash)
+        return path
+
+    def ftp_XMD5(self, path):
+        """
+        Reply the md5 of a file
+        :param path: file path on the file system
+        :return: the file path on success, else None
+        """
+        return self.__reply_hash(path, 'md5')
+
+    def ftp_XSHA256(self, path):
+        """
+        Reply the sha256 of a file
+        :param path: file path on the file system
+        :return: the file path on success, else None
+        """
+        return self.__reply_hash(path, 'sha256')
+
+
+    def __iter_manifest(self, dpath):
+        """
+        Private function to produce the manifest of a directory tree, one line at a time: the tree is walked while
+        the manifest is sent, so that a large tree does not stall the other sessions of the IO loop.
+        Entries removed or unreadable during the walk are skipped.
+        :param dpath: directory path on the file system
+        :return: generator of the encoded manifest lines
+        """
+        timefunc = time.gmtime if self.use_gmt_times else time.localtime
+        for root, dirs, files in os.walk(dpath):
+            dirs.sort()
+            for name in dirs:
+                fname = os.path.join(root, name)
+                if not self.fs.validpath(fname):
+                    continue
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    continue
+                entry = {'path': os.path.relpath(fname, dpath), 'type': 'dir',
+                         'modify': time.strftime('%Y%m%d%H%M%S', timefunc(stat.st_mtime))}
+                yield (json.dumps(entry) + '\r\n').encode('utf-8')
+            for name in sorted(files):
+                fname = os.path.join(root, name)
+                if not self.fs.validpath(fname):
+                    continue
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    continue
+                entry = {'path': os.path.relpath(fname, dpath), 'type': 'file', 'size': str(stat.st_size),
+                         'modify': time.strftime('%Y%m%d%H%M%S', timefunc(stat.st_mtime))}
+                for hash_type in ['md5', 'sha256']:
+                    if name + '.' + hash_type in files:
+                        try:
+                            entry[hash_type] = Helpers.read_signature(fname + '.' + hash_type)
+                        except OSError:
+                            pass
+                    elif self.checksum_index:
+                        file_hash = self.checksum_index.lookup(fname, hash_type, stat)
+                        if file_hash:
+                            entry[hash_type] = file_hash
+                yield (json.dumps(entry) + '\r\n').encode('utf-8')
+
+    def ftp_XMANIFEST(self, path):
+        """
+        Send the manifest of a directory tree over the data channel. The manifest is produced while it is sent,
+        as MLSD listings are.
+        :param path: directory path on the file system
+        :return: the directory path on success, else None
+        """
+        if not self.fs.isdir(path):
+            self.respond('501 No such directory.')
+            return None
+        producer = BufferedIteratorProducer(self.__iter_manifest(path))
+        self.push_dtp_data(producer, isproducer=True, cmd='XMANIFEST')
+        return path
+
+
+    def ftp_MODE(self, line):
+        """
+        Set the transfer mode: S (stream) or, when compression is enabled, Z (zlib compressed stream)
+        :param line: mode
+        :return:
+        """
+        mode = line.upper()
+        if mode == 'Z' and self.compression:
+            self.transfer_mode = mode
+            self.respond('200 Transfer mode set to: Z')
+        elif mode == 'S':
+            self.transfer_mode = mode
+            self.respond('200 Transfer mode set to: S')
+        elif mode in ['B', 'C', 'Z']:
+            self.respond('504 Unimplemented MODE type.')
+        else:
+            self.respond('501 Unrecognized MODE type.')
+
+    def __get_compression_level(self, file):
+        """
+        Private function to get the compression level of a file according to the compression policy
+        :param file: file object
+        :return: zlib compression level
+        """
+        if os.path.splitext(file.name)[1].lower() in self.compression_skip_extensions:
+            return 0
+        try:
+            size = os.fstat(file.fileno()).st_size
+        except (OSError, ValueError):
+            # file served from the hot file cache
+            size = getattr(file, 'size', None)
+        if size is not None and size - file.tell() < self.compression_min_size:
+            return 0
+        return self.compression_level
+
+    def ftp_RETR(self, file):
+        """
+        Retrieve a file, from the hot file cache when the server has one and the file is small enough
+        :param file: file path on the file system
+        :return: the file path on success, else None
+        """
+        if self.hot_cache is None:
+            return super().ftp_RETR(file)
+        try:
+            fd = self.run_as_current_user(self.hot_cache.open, file)
+        except (OSError, FilesystemError) as err:
+            logging.debug('Hot file cache: %s', err)
+            fd = None
+        if fd is None:
+            return super().ftp_RETR(file)
+
+        rest_pos = self._restart_position
+        self._restart_position = 0
+        if rest_pos > fd.size:
+            self.respond('554 REST position (%d) > file size (%d)' % (rest_pos, fd.size))
+            return None
+        fd.seek(rest_pos)
+        self.push_dtp_data(FileProducer(fd, self._current_type), isproducer=True, file=fd, cmd='RETR')
+        return file
+
+    def push_dtp_data(self, data, isproducer=False, file=None, cmd=None):
+        """
+        Push data into the data channel, compressed in MODE Z
+        :param data: data to send or producer object
+        :param isproducer: whether data is a producer
+        :param file: file object to send, if any
+        :param cmd: command
+        :return:
+        """
+        if self.transfer_mode == 'Z':
+            level = self.__get_compression_level(file) if file else self.compression_level
+            if isproducer:
+                data = QuickFtpZlibProducer(data, level, file)
+                file = data if file else None
+            else:
+                data = zlib.compress(data, level)
+        super().push_dtp_data(data, isproducer=isproducer, file=file, cmd=cmd)
+
+
+class QuickFtpHandler(QuickFtpCommands, FTPHandler):
+    """
+    FTP handler with the quickftp commands.
+    """
+    proto_cmds = dict(FTPHandler.proto_cmds, **QuickFtpCommands.commands)
+
+
+class QuickFtpTlsHandler(QuickFtpCommands, TLS_FTPHandler):
+    """
+    FTP over TLS handler with the quickftp commands.
+    """
+    proto_cmds = dict(TLS_FTPHandler.proto_cmds, **QuickFtpCommands.commands)
 
 
 class QuickFtpServer:
@@ -49,54 +485,260 @@ class QuickFtpServer:
         # parse config file
         parameters = Helpers.get_param_from_config_file(self.configfile,
                                                         ['ip', 'port', 'ftp_root_dir', 'clients'],
-                                                        ['client_timeout', 'pem_certificate'])
+                                                        ['client_timeout', 'pem_certificate',
+                                                         'use_sendfile', 'send_buffer_size',
+                                                         'concurrency', 'workers', 'checksum_index',
+                                                         'checksum_index_interval', 'compression',
+                                                         'compression_level', 'compression_min_size',
+                                                         'compression_skip_extensions', 'users_file',
+                                                         'password_cache_size', 'config_reload_interval',
+                                                         'read_limit', 'metrics_ip', 'metrics_port',
+                                                         'hot_cache_size', 'hot_file_max_size'])
         self.ip = parameters['ip']
         self.port = int(parameters['port'])
         self.root_dir = os.path.abspath(parameters['ftp_root_dir'])
 
+        # concurrency model
+        self.concurrency = parameters.get('concurrency') or 'async'
+        if self.concurrency not in ['async', 'threaded', 'multiprocess']:
+            raise Exception('concurrency must be async, threaded or multiprocess')
+        self.workers = int(parameters.get('workers') or os.cpu_count())
+        self.server_inst = None
+        self.processes = []
+
         # use certificate ?
-        if parameters['pem_certificate']:
+        if parameters.get('pem_certificate'):
             pem = os.path.abspath(parameters['pem_certificate'])
             logging.info('TLS mode use %s', pem)
             if not os.path.exists(pem):
                 raise IOError('File: ' + pem + ' not found')
-            self.handler = TLS_FTPHandler
+            self.handler = type('QuickFtpTlsHandler', (QuickFtpTlsHandler,), {})
             self.handler.certfile = pem
         else:
             logging.info('Unsecure mode')
-            self.handler = FTPHandler
+            # subclass per server: the class attributes set below do not leak to other servers
+            self.handler = type('QuickFtpHandler', (QuickFtpHandler,), {})
 
         # Use timeout ?
-        if parameters['client_timeout']:
+        if parameters.get('client_timeout'):
             self.handler.timeout = int(parameters['client_timeout'])
 
+        # Zero-copy transfers (plain FTP only) ?
+        if parameters.get('use_sendfile') is not None:
+            self.handler.use_sendfile = bool(parameters['use_sendfile'])
+
+        # Data channel: bandwidth limits and send buffer size
+        dtp_attributes = {'global_bucket': None, 'user_buckets': dict()}
+        if parameters.get('read_limit'):
+            dtp_attributes['global_bucket'] = QuickFtpTokenBucket(int(parameters['read_limit']))
+        if parameters.get('send_buffer_size'):
+            dtp_attributes['ac_out_buffer_size'] = int(parameters['send_buffer_size'])
+        self.handler.dtp_handler = type('QuickFtpDTPHandler', (QuickFtpThrottledDTP, self.handler.dtp_handler),
+                                        dtp_attributes)
+        self.handler.user_sessions = dict()
+
+        # Compressed transfers (MODE Z) ?
+        if parameters.get('compression'):
+            self.handler.compression = True
+            if parameters.get('compression_level') is not None:
+                self.handler.compression_level = int(parameters['compression_level'])
+            if parameters.get('compression_min_size') is not None:
+                self.handler.compression_min_size = int(parameters['compression_min_size'])
+            if parameters.get('compression_skip_extensions') is not None:
+                self.handler.compression_skip_extensions = [extension.lower() for extension
+                                                            in parameters['compression_skip_extensions']]
+
         if not os.path.exists(self.root_dir):
             logging.debug('Create %s', self.root_dir)
             os.makedirs(self.root_dir)
 
-        self.authorizer = QuickFtpAuthorizer()
-        for client in parameters['clients']:
+        # Metrics, served over HTTP ?
+        self.metrics = QuickFtpMetrics()
+        self.__declare_metrics()
+        self.handler.metrics = self.metrics
+        self.metrics_ip = parameters.get('metrics_ip') or '127.0.0.1'
+        self.metrics_port = int(parameters.get('metrics_port') or 0)
+        self.metrics_server = None
+
+        # Maintain a checksum index ?
+        self.checksum_index = None
+        self.checksum_index_interval = int(parameters.get('checksum_index_interval') or 0)
+        if parameters.get('checksum_index'):
+            index_file = os.path.abspath(parameters['checksum_index'])
+            logging.info('Checksum index in %s', index_file)
+            self.checksum_index = QuickFtpChecksumIndex(self.root_dir, index_file, metrics=self.metrics)
+            self.handler.checksum_index = self.checksum_index
+
+        # Serve small files from memory ?
+        if parameters.get('hot_cache_size'):
+            self.handler.hot_cache = QuickFtpHotFileCache(int(parameters['hot_cache_size']),
+                                                          int(parameters.get('hot_file_max_size') or 1024 * 1024),
+                                                          metrics=self.metrics)
+
+        self.authorizer = self.__build_authorizer(parameters)
+        self.handler.authorizer = self.authorizer
+
+        # Watch the configuration file ?
+        self.config_reload_interval = float(parameters.get('config_reload_interval', 5))
+        self.__config_mtime = os.stat(self.configfile).st_mtime_ns
+
+    def __declare_metrics(self):
+        """
+        Private function to declare the server metrics
+        :return:
+        """
+        self.metrics.counter('quickftp_server_connections_total', 'Control connections accepted.')
+        self.metrics.gauge('quickftp_server_sessions', 'Open control connections.')
+        self.metrics.counter('quickftp_server_logins_total', 'Logins by result (success, failure, rejected).')
+        self.metrics.histogram('quickftp_server_command_seconds', 'Time to process a command.')
+        self.metrics.counter('quickftp_server_transfers_total', 'File transfers by command and result.')
+        self.metrics.counter('quickftp_server_transfer_bytes_total', 'Bytes of file transfers.')
+        self.metrics.histogram('quickftp_server_transfer_seconds', 'Duration of file transfers.')
+        self.metrics.histogram('quickftp_server_transfer_throughput_bytes_per_second',
+                               'Throughput of completed file transfers.', QuickFtpMetrics.throughput_buckets)
+        self.metrics.histogram('quickftp_server_index_refresh_seconds', 'Duration of checksum index refreshes.')
+        self.metrics.counter('quickftp_server_hot_cache_total', 'Hot file cache lookups by result.')
+        self.metrics.gauge('quickftp_server_hot_cache_bytes', 'Size of the files in the hot file cache.')
+
+    def __start_metrics_server(self, port):
+        """
+        Private function to serve the metrics over HTTP when a metrics port is configured
+        :param port: listening port
+        :return:
+        """
+        if self.metrics_port:
+            self.metrics_server = QuickFtpMetricsServer(self.metrics, self.metrics_ip, port)
+            self.metrics_server.start()
+
+    def __build_authorizer(self, parameters):
+        """
+        Private function to build the authorizer of the configured users, their directories are created
+        :param parameters: configuration parameters
+        :return: the authorizer
+        """
+        users_file = parameters.get('users_file')
+        authorizer = QuickFtpAuthorizer(cache_size=int(parameters.get('password_cache_size', 1024)),
+                                        users_file=os.path.abspath(users_file) if users_file else None,
+                                        root_dir=self.root_dir)
+        for client in parameters['clients'] or []:
             user_dir = os.path.join(self.root_dir, client['directory'])
-            if not os.path.exists(user_dir):
-                logging.debug('Create %s', user_dir)
-                os.makedirs(user_dir)
+            Helpers.create_dir_if_not_exist(user_dir)
             logging.info('Add user %s with directory %s',
                              client['name'], user_dir)
-            self.authorizer.add_user(client['name'],
-                                     client['password'],
-                                     user_dir,
-                                     perm='elr')
+            authorizer.add_user(client['name'],
+                                client['password'],
+                                user_dir,
+                                perm='elr')
+            authorizer.user_table[client['name']].update(read_limit=int(client.get('read_limit') or 0),
+                                                         max_connections=int(client.get('max_connections') or 0))
+        return authorizer
 
-        self.handler.authorizer = self.authorizer
+    def reload(self):
+        """
+        Read the configuration file again and apply the users, the global read limit and the client timeout to the new
+        sessions.
+        Existing sessions keep the users and timeout they were opened with. The other parameters require a restart.
+        On error, the current configuration is kept.
+        :return: True if the configuration was applied
+        """
+        try:
+            parameters = Helpers.get_param_from_config_file(self.configfile, ['clients'],
+                                                            ['client_timeout', 'users_file',
+                                                             'password_cache_size', 'read_limit'])
+            authorizer = self.__build_authorizer(parameters)
+        except Exception as e:
+            logging.error('Unable to reload %s, keep the current configuration: %s', self.configfile, e)
+            return False
+
+        if parameters.get('client_timeout'):
+            self.handler.timeout = int(parameters['client_timeout'])
+        read_limit = int(parameters.get('read_limit') or 0)
+        global_bucket = self.handler.dtp_handler.global_bucket
+        if not read_limit:
+            self.handler.dtp_handler.global_bucket = None
+        elif global_bucket is None or global_bucket.rate != read_limit:
+            self.handler.dtp_handler.global_bucket = QuickFtpTokenBucket(read_limit)
+        self.authorizer = authorizer
+        self.handler.authorizer = authorizer
+        logging.info('Configuration reloaded from %s', self.configfile)
+        return True
+
+    def __check_config(self):
+        """
+        Private function called periodically by the ioloop: reload the configuration file when it changed
+        :return:
+        """
+        try:
+            mtime = os.stat(self.configfile).st_mtime_ns
+        except OSError as e:
+            logging.error('Unable to read %s: %s', self.configfile, e)
+            return
+        if mtime != self.__config_mtime:
+            self.__config_mtime = mtime
+            self.reload()
+
+    def __watch_config(self, ioloop):
+        """
+        Private function to check the configuration file every config_reload_interval seconds from an ioloop
+        :param ioloop: ioloop of the server
+        :return:
+        """
+        if self.config_reload_interval > 0:
+            ioloop.call_every(self.config_reload_interval, self.__check_config)
+
+    def __start_checksum_index(self):
+        """
+        Private function to start the refresh of the checksum index, if any, in a background thread
+        :return:
+        """
+        if self.checksum_index:
+            self.checksum_index.start(self.checksum_index_interval)
+
+    def __serve_process(self, sock, index):
+        """
+        Private function run by each worker process of the multiprocess mode
+        :param sock: listening socket shared by the worker processes
+        :param index: worker index, the worker metrics are served on metrics_port + index
+        :return:
+        """
+        self.__start_metrics_server(self.metrics_port + index)
+        server_inst = FTPServer(sock, self.handler, ioloop=IOLoop())
+        self.__watch_config(server_inst.ioloop)
+        server_inst.serve_forever()
 
     def serve(self):
         """
         run the server forever
+        - async: a single thread serves all the connections
+        - threaded: a thread is started for each connection
+        - multiprocess: 'workers' processes serve the connections accepted on a shared listening socket
         :return:
         """
-        self.server_inst = FTPServer((self.ip, self.port), self.handler)
+        if self.concurrency == 'multiprocess':
+            sock = socket.create_server((self.ip, self.port), backlog=100)
+            context = multiprocessing.get_context('fork')
+            self.processes = [context.Process(target=self.__serve_process, args=(sock, i), daemon=True)
+                              for i in range(self.workers)]
+            for process in self.processes:
+                process.start()
+            sock.close()
+            # started after the fork: a worker forked while the refresh thread holds the index lock would never get it
+            self.__start_checksum_index()
+            logging.info('Listen on %s:%d with %d processes',
+                             self.ip, self.port, self.workers)
+            for process in self.processes:
+                process.join()
+            return
+
+        if self.concurrency == 'threaded':
+            self.server_inst = ThreadedFTPServer((self.ip, self.port), self.handler)
+        else:
+            self.server_inst = FTPServer((self.ip, self.port), self.handler)
         logging.info('Listen on %s:%d',
                          self.ip, self.port)
+        self.__start_checksum_index()
+        self.__start_metrics_server(self.metrics_port)
+        self.__watch_config(self.server_inst.ioloop)
         self.server_inst.serve_forever()
 
     def terminate(self):
@@ -104,6 +746,13 @@ class QuickFtpServer:
         Terminate the server
         :return:
         """
-        self.server_inst.close_all()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        if self.server_inst:
+            self.server_inst.close_all()
+        if self.metrics_server:
+            self.metrics_server.close()
+            self.metrics_server = None
         logging.info('closed_all')
         #self.server_inst.close()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import io
+import time
+import logging
+from quickftp.qftp_helper import Helpers
+
+
+class QuickFtpStream(io.RawIOBase):
+    """
+    This is a read-only file-like object over the data channel of a RETR command, as returned by
+    QuickFtpClient.stream(). Data is decompressed (MODE Z) and hashed as it is read; the hash is verified at the end
+    of the file. The session is given back to its pool when the stream is closed: closing the stream before the end
+    of the file aborts the transfer.
+    """
+    def __init__(self, fpath, conn, ftp, pool, decompressor=None, file_hash=None, expected_hash=None,
+                 blocksize=64 * 1024, progress=None, total=None):
+        """
+        Constructor
+        :param fpath: file path on the server
+        :param conn: data connection of the RETR command
+        :param ftp: FTP session of the transfer, acquired from pool
+        :param pool: QuickFtpConnectionPool of the session
+        :param decompressor: zlib decompressor when the data is compressed (MODE Z), else None
+        :param file_hash: hash object updated with the data, None to skip the verification
+        :param expected_hash: expected hash string
+        :param blocksize: size of the reads on the data connection
+        :param progress: function called as progress(fpath, bytes read, total bytes, bytes per second) when data is
+                         received
+        :param total: file size, None if unknown
+        """
+        super().__init__()
+        self.fpath = fpath
+        self.total = total
+        self.bytes_read = 0
+        self.__conn = conn
+        self.__ftp = ftp
+        self.__pool = pool
+        self.__decompressor = decompressor
+        self.__file_hash = file_hash
+        self.__expected_hash = expected_hash
+        self.__blocksize = blocksize
+        self.__progress = progress
+        self.__pending = memoryview(b'')
+        self.__eof = False
+        self.__start = time.monotonic()
+
+    def readable(self):
+        return True
+
+    def __receive(self):
+        """
+        Private function to receive the next chunk of data, or to end the transfer
+        :return:
+        """
+        data = self.__conn.recv(self.__blocksize)
+        if not data:
+            self.__end()
+            return
+        if self.__decompressor:
+            data = self.__decompressor.decompress(data)
+        if self.__file_hash:
+            self.__file_hash.update(data)
+        self.bytes_read += len(data)
+        self.__pending = memoryview(data)
+        if self.__progress:
+            elapsed = time.monotonic() - self.__start
+            self.__progress(self.fpath, self.bytes_read, self.total, self.bytes_read / elapsed if elapsed else 0)
+
+    def __end(self):
+        """
+        Private function to end the transfer: check the server reply and the hash, give the session back
+        :return:
+        """
+        self.__eof = True
+        self.__conn.close()
+        self.__conn = None
+        try:
+            self.__ftp.voidresp()
+        except Exception:
+            self.__release(discard=True)
+            raise Exception('Unable to get %s file' % self.fpath)
+        self.__release()
+        if self.__decompressor and not self.__decompressor.eof:
+            raise Exception('Unable to get %s file: truncated compressed stream' % self.fpath)
+        if self.__file_hash:
+            Helpers.check_hash(self.fpath, self.__file_hash.hexdigest(), self.__expected_hash)
+
+    def __release(self, discard=False):
+        """
+        Private function to give the session back to the pool
+        :param discard: close the session instead of keeping it for reuse
+        :return:
+        """
+        if self.__ftp is not None:
+            self.__pool.release(self.__ftp, discard=discard)
+            self.__ftp = None
+
+    def readinto(self, buffer):
+        """
+        Read data into a buffer
+        :param buffer: writable buffer
+        :return: number of bytes read, 0 at the end of the file
+        """
+        while not self.__pending and not self.__eof:
+            self.__receive()
+        size = min(len(buffer), len(self.__pending))
+        buffer[:size] = self.__pending[:size]
+        self.__pending = self.__pending[size:]
+        return size
+
+    def chunks(self):
+        """
+        Iterate over the data as it is received
+        :return: generator of bytes
+        """
+        while True:
+            while not self.__pending and not self.__eof:
+                self.__receive()
+            if not self.__pending:
+                return
+            data = self.__pending.tobytes()
+            self.__pending = memoryview(b'')
+            yield data
+
+    def close(self):
+        """
+        Close the stream, the transfer is aborted when the end of the file was not reached
+        :return:
+        """
+        if self.__conn is not None:
+            logging.debug('abort transfer of %s', self.fpath)
+            self.__conn.close()
+            self.__conn = None
+            try:
+                # 426 or 226 reply, depending on when the server noticed the closed connection
+                self.__ftp.getmultiline()
+                self.__release()
+            except Exception:
+                self.__release(discard=True)
+        super().close()
@@ -0,0 +1,144 @@
+import time
+import threading
+
+
+class QuickFtpTokenBucket:
+    """
+    This token bucket limits a bandwidth: each sent byte consumes a token and tokens are refilled at 'rate' per second,
+    up to 'burst' tokens. It can be shared by the data channels of several sessions and threads.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Constructor
+        :param rate: bandwidth in bytes per second
+        :param burst: bucket capacity in bytes, a tenth of a second of bandwidth (at least 16 KB) by default
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate / 10, 16 * 1024))
+        self.__tokens = self.burst
+        self.__timestamp = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        """
+        Private function to add the tokens earned since the last call, the lock must be held
+        :return:
+        """
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__timestamp) * self.rate)
+        self.__timestamp = now
+
+    def available(self):
+        """
+        :return: number of bytes that can be sent now
+        """
+        with self.__lock:
+            self.__refill()
+            return int(self.__tokens)
+
+    def consume(self, size):
+        """
+        Consume the tokens of sent bytes
+        :param size: number of bytes sent
+        :return:
+        """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= size
+
+    def delay(self):
+        """
+        :return: seconds to wait until tokens are available
+        """
+        with self.__lock:
+            self.__refill()
+            return max(0.0, (1 - self.__tokens) / self.rate)
+
+
+class QuickFtpThrottledDTP:
+    """
+    This mixin limits the bandwidth of the data channels sending data to the clients (RETR, listings) with token
+    buckets: a global one shared by all the sessions of the server, and one per user shared by all the sessions of
+    the user. A channel out of tokens is paused until tokens are refilled, so small transfers are served between the
+    chunks of bulk transfers instead of waiting for them.
+    """
+    global_bucket = None
+    user_buckets = None
+
+    __buckets_lock = threading.Lock()
+
+    def __init__(self, sock, cmd_channel):
+        """
+        Constructor: select the buckets of the session
+        :param sock: data socket
+        :param cmd_channel: FTP handler of the session
+        """
+        super().__init__(sock, cmd_channel)
+        self.__buckets = [bucket for bucket in [self.global_bucket, self.__get_user_bucket(cmd_channel)] if bucket]
+        self.__throttler = None
+
+    def __get_user_bucket(self, cmd_channel):
+        """
+        Private function to get the bucket of the session user, from the 'read_limit' of the user
+        :param cmd_channel: FTP handler of the session
+        :return: the bucket, None when the user bandwidth is not limited
+        """
+        try:
+            rate = cmd_channel.authorizer.user_table[cmd_channel.username].get('read_limit')
+        except KeyError:
+            return None
+        if not rate or self.user_buckets is None:
+            return None
+        with self.__buckets_lock:
+            bucket = self.user_buckets.get(cmd_channel.username)
+            if bucket is None or bucket.rate != rate:
+                bucket = QuickFtpTokenBucket(rate)
+                self.user_buckets[cmd_channel.username] = bucket
+            return bucket
+
+    def use_sendfile(self):
+        """
+        :return: True if the file can be sent with sendfile, never when the bandwidth is limited
+        """
+        return not self.__buckets and super().use_sendfile()
+
+    def send(self, data):
+        """
+        Send as many bytes as the buckets allow, pause the channel when they are empty
+        :param data: data to send
+        :return: number of bytes sent
+        """
+        if not self.__buckets:
+            return super().send(data)
+
+        allowed = min(bucket.available() for bucket in self.__buckets)
+        if allowed <= 0:
+            self.__sleep(max(bucket.delay() for bucket in self.__buckets))
+            return 0
+        num_sent = super().send(data[:allowed])
+        for bucket in self.__buckets:
+            bucket.consume(num_sent)
+        return num_sent
+
+    def __sleep(self, delay):
+        """
+        Private function to pause the channel
+        :param delay: seconds
+        :return:
+        """
+        def wake_up():
+            self.__throttler = None
+            self.add_channel(events=self.ioloop.WRITE)
+
+        if self.__throttler is None:
+            self.del_channel()
+            self.__throttler = self.ioloop.call_later(delay, wake_up, _errback=self.handle_error)
+
+    def close(self):
+        """
+        Close the channel
+        :return:
+        """
+        if self.__throttler is not None and not self.__throttler.cancelled:
+            self.__throttler.cancel()
+        super().close()
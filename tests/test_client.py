@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import time
 import os
@@ -9,6 +10,7 @@ sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),'..'))
 
 from quickftp.qftp_helper import Helpers
 from quickftp.qftp_client import QuickFtpClient
+from quickftp.qftp_async_client import AsyncQuickFtpClient
 from quickftp.qftp_server import QuickFtpServer
 
 
@@ -47,17 +49,285 @@ class TestClient(unittest.TestCase):
         self.__class__.client = QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml'))
         self.assertTrue(self.__class__.client.is_connected(), 'client not connected')
 
+    def test_artifact_cache(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_cache1_conf.yml')) as client:
+            first_path = client.get('data2')
+            self.assertEqual(client.metrics.get('quickftp_client_artifact_cache_total', result='miss'), 1)
+            self.assertTrue(os.access(first_path, os.W_OK) and os.stat(first_path).st_mode & 0o200,
+                            'downloaded file made read-only by the cache')
+
+        # another workspace gets data2 from the cache
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_cache2_conf.yml')) as client:
+            local_path = client.get('data2', verify='md5')
+            self.assertEqual(client.metrics.get('quickftp_client_artifact_cache_total', result='hit'), 1,
+                             'data2 not got from the cache')
+            self.assertEqual(client.metrics.get('quickftp_client_transfers_total', result='completed'), 0,
+                             'data2 transferred again')
+            self.assertNotEqual(local_path, first_path)
+            with open(local_path, 'rb') as file:
+                self.assertEqual(file.read(), b'Hello World 2', 'data2 not materialized')
+
+            # least recently used entries are evicted
+            client.cache.max_size = 20
+            other = os.path.join(client.workspace, 'other')
+            with open(other, 'wb') as file:
+                file.write(b'x' * 10)
+            client.cache.add('md5', '0' * 32, other)
+            data2_hash = Helpers.compute_file_hash(local_path, 'md5')
+            self.assertFalse(client.cache.materialize('md5', data2_hash, other),
+                             'least recently used entry not evicted')
+            self.assertTrue(client.cache.materialize('md5', '0' * 32, other), 'last entry evicted')
+
+    def test_async_client(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+
+        async def run(client):
+            self.assertTrue(await client.is_connected(), 'client not connected')
+            self.assertTrue(await client.is_present('data1'), 'data1 file not present')
+            self.assertFalse(await client.is_present('data1.md5'), 'data1.md5 file is present')
+
+            self.assertIsNotNone(await client.get('data2', verify='sha256'), 'unable to get data2')
+            local_dir = await client.get('directory')
+            self.assertTrue(os.path.isfile(os.path.join(local_dir, 'subdirectory', 'data5')), 'data5 not copied')
+
+            # wrong signature
+            with self.assertRaises(Exception):
+                await client.get('data3', verify='sha256')
+
+        async def main():
+            client = AsyncQuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml'))
+            try:
+                await run(client)
+            finally:
+                await client.close()
+
+        asyncio.run(main())
+
+    def test_async_timeout(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+
+        async def main():
+            client = AsyncQuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml'))
+            try:
+                await client.get('data1')
+                # idle sessions closed by the server timeout
+                await asyncio.sleep(6)
+                self.assertIsNotNone(await client.get('data1'), 'unable to get data1 after the server timeout')
+            finally:
+                await client.close()
+
+        asyncio.run(main())
+
+    def test_compression(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_compression_conf.yml')) as client:
+            local_path = client.get('data2', verify='md5')
+            self.assertEqual(client.ftp.transfer_mode, 'Z', 'data2 not transferred in MODE Z')
+            with open(local_path, 'rb') as file:
+                self.assertEqual(file.read(), b'Hello World 2', 'data2 not decompressed')
+
+            local_dir = client.get('directory')
+            self.assertTrue(os.path.isfile(os.path.join(local_dir, 'subdirectory', 'data5')), 'data5 not copied')
+
+    def test_connection_pool(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) as client:
+            self.assertIsNone(client.ftp, 'client connected before first use')
+            client.get('data1')
+            session = client.ftp
+
+        # the session is reused by the next client
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) as client:
+            client.get('data1')
+            self.assertIs(client.ftp, session, 'session not reused')
+
+        # the sessions held by live clients do not count against the pool size (8)
+        clients = [QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) for i in range(10)]
+        for client in clients:
+            client.get('data1')
+        for client in clients:
+            client.close()
+
+        # a session interrupted during a transfer is not given back to the pool
+        def fail(*args):
+            raise ValueError('progress failure')
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) as client:
+            with self.assertRaises(Exception):
+                client.get('data2', progress=fail)
+            with self.assertRaises(Exception):
+                client.get('directory', workers=2, progress=fail)
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) as client:
+            for i in range(3):
+                with open(client.get('data2'), 'rb') as file:
+                    self.assertEqual(file.read(), b'Hello World 2', 'desynchronized session reused')
+
     def test_files_present(self):
         self.assertTrue(self.__class__.client.is_present('data1'), 'data1 file not present')
         self.assertFalse(self.__class__.client.is_present('data1.md5'), 'data1.md5 file is present')
         self.assertFalse(self.__class__.client.is_present('data1.sha256'),'data1.sha256 file is present')
 
+    def test_get_many(self):
+        client = self.__class__.client
+        results = client.get_many(['data2', 'directory', 'data3', 'missing', 'data2'], verify='sha256', workers=2)
+        self.assertEqual(list(results), ['data2', 'directory', 'data3', 'missing'], 'paths not deduplicated')
+        self.assertIsNone(results['data2']['error'])
+        self.assertTrue(os.path.isfile(results['data2']['local_path']), 'data2 not copied')
+        # partial failures are reported per path
+        self.assertIn('bad signature', results['data3']['error'])
+        self.assertIn('directory/data4', results['directory']['error'], 'data4 failure not reported')
+        self.assertIsNone(results['missing']['local_path'])
+        self.assertIsNotNone(results['missing']['error'])
+
+        results = client.get_many(['data1', 'directory'])
+        self.assertEqual([result['error'] for result in results.values()], [None, None])
+        self.assertTrue(os.path.isfile(os.path.join(results['directory']['local_path'], 'subdirectory', 'data5')),
+                        'data5 not copied')
+
+    def test_listing_cache(self):
+        client = self.__class__.client
+        client.invalidate_cache()
+
+        listings = []
+        mlsd = client.ftp.mlsd
+        client.ftp.mlsd = lambda *args: listings.append(args) or mlsd(*args)
+        try:
+            for fpath in ['data1', 'data2', 'data2.md5', 'data3']:
+                self.assertTrue(client.is_present(fpath), '%s file not present' % fpath)
+            self.assertEqual(len(listings), 1, 'directory listed more than once')
+
+            client.invalidate_cache('/')
+            self.assertTrue(client.is_present('data1'), 'data1 file not present')
+            self.assertEqual(len(listings), 2, 'directory listing not invalidated')
+        finally:
+            del client.ftp.mlsd
+
+    def test_manifest(self):
+        client = self.__class__.client
+        client.invalidate_cache()
+        self.assertTrue(client.is_connected(), 'Client not connected')
+
+        listings = []
+        mlsd = client.ftp.mlsd
+        client.ftp.mlsd = lambda *args: listings.append(args) or mlsd(*args)
+        try:
+            local_path = client.get('directory')
+            self.assertEqual(len(listings), 1, 'directory tree listed instead of using the manifest')
+            self.assertTrue(os.path.isfile(os.path.join(local_path, 'subdirectory', 'data5')), 'data5 not transferred')
+        finally:
+            del client.ftp.mlsd
+
+    def test_metrics(self):
+        client = self.__class__.client
+        client.invalidate_cache()
+        transfers = client.metrics.get('quickftp_client_transfers_total', result='completed')
+        verifications = client.metrics.get('quickftp_client_verifications_total', result='success')
+        updates = []
+        client.metrics.add_listener(lambda name, value, labels: updates.append(name))
+
+        client.get('data2', verify='md5')
+        self.assertEqual(client.metrics.get('quickftp_client_transfers_total', result='completed'), transfers + 1)
+        self.assertEqual(client.metrics.get('quickftp_client_verifications_total', result='success'),
+                         verifications + 1)
+        self.assertGreaterEqual(client.metrics.get('quickftp_client_listing_seconds', command='MLSD')['count'], 1)
+        self.assertIn('quickftp_client_transfer_seconds', updates, 'listener not called')
+        self.assertRegex(client.metrics.render(), r'\nquickftp_client_transfer_bytes_total \d+\n')
+
+    def test_resume(self):
+        client = self.__class__.client
+        # simulate an interrupted transfer of data2
+        part = os.path.join(client.workspace, 'data2.part')
+        with open(part, 'wb') as file:
+            file.write(b'Hello')
+
+        local_path = client.get('data2', verify='md5')
+        self.assertFalse(os.path.exists(part), 'partial file not renamed')
+        with open(local_path, 'rb') as file:
+            self.assertEqual(file.read(), b'Hello World 2', 'data2 not resumed')
+
+    def test_segments(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        with QuickFtpClient(os.path.join(current_dir_path, 'conf/client_segments_conf.yml')) as client:
+            updates = []
+            local_path = client.get('data2', verify='md5', progress=lambda *args: updates.append(args))
+            self.assertFalse(os.path.exists(local_path + '.part'), 'partial file not renamed')
+            with open(local_path, 'rb') as file:
+                self.assertEqual(file.read(), b'Hello World 2', 'data2 segments not assembled')
+            # segments complete in any order: check the bytes added by each update
+            done = [0] + sorted(update[1] for update in updates)
+            self.assertEqual(sorted(done[i + 1] - done[i] for i in range(len(updates))), [3, 5, 5],
+                             'data2 not got in 3 segments')
+
+            # the sessions are still usable after the aborted segments
+            self.assertTrue(client.is_present('data3'), 'session not usable after a segmented transfer')
+            client.get('data3')
+
+            # an interrupted segmented transfer leaves no file that could be resumed
+            def interrupt(*args):
+                raise KeyboardInterrupt()
+            os.remove(local_path)
+            with self.assertRaises(KeyboardInterrupt):
+                client.get('data2', progress=interrupt)
+            self.assertEqual([f for f in os.listdir(client.workspace) if f.startswith('data2')], [],
+                             'preallocated file left behind')
+
+            # a preallocated file left by a killed process is not resumed
+            with open(local_path + '.segments', 'wb') as file:
+                file.write(b'\x00' * 13)
+            with open(client.get('data2'), 'rb') as file:
+                self.assertEqual(file.read(), b'Hello World 2', 'preallocated file resumed')
+
+    def test_stream(self):
+        client = self.__class__.client
+        updates = []
+        with client.stream('data2', verify='md5', progress=lambda *args: updates.append(args)) as stream:
+            self.assertEqual(stream.read(), b'Hello World 2', 'data2 not streamed')
+        self.assertEqual(updates[-1][:3], ('data2', 13, 13), 'progress not reported')
+
+        # stream closed before the end of the file
+        with client.stream('data3') as stream:
+            self.assertEqual(len(stream.read(1)), 1)
+        self.assertTrue(client.is_present('data3'), 'session not usable after an aborted stream')
+
+        updates = []
+        client.get('directory', progress=lambda *args: updates.append(args))
+        self.assertIn('directory/subdirectory/data5', [update[0] for update in updates], 'progress not reported')
+
+    def test_sync(self):
+        client = self.__class__.client
+        local_dir = client.sync('directory')
+        data4 = os.path.join(local_dir, 'data4')
+        mtime = os.stat(data4).st_mtime_ns
+
+        time.sleep(0.1)
+        client.sync('directory')
+        self.assertEqual(os.stat(data4).st_mtime_ns, mtime, 'unchanged data4 transferred again')
+
+        # a locally modified file is transferred again
+        with open(data4, 'a') as file:
+            file.write('modified')
+        client.sync('directory')
+        with open(data4, 'r') as file:
+            self.assertNotIn('modified', file.read(), 'modified data4 not transferred again')
+
     def test_timeout(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        clients = [QuickFtpClient(os.path.join(current_dir_path, 'conf/client_conf.yml')) for i in range(2)]
+        clients[0].get('data2', verify='md5')
+        clients[1].get('directory')
+
         for i in range(6, 0, -1):
             print('\rWait %d sec' % i, end='')
             time.sleep(1)
         print('')
 
+        # the commands sent before a transfer reconnect a session closed by the server timeout
+        self.assertIsNotNone(clients[0].get('data2', verify='md5'), 'unable to verify data2 after the server timeout')
+        self.assertIsNotNone(clients[1].get('directory'), 'unable to get the manifest after the server timeout')
+        for client in clients:
+            client.close()
+
         self.assertFalse(self.__class__.client.is_connected(), 'client still connected')
         self.__class__.client.get('data1')
         self.assertTrue(self.__class__.client.is_connected(), 'client not connected')
@@ -90,6 +360,18 @@ class TestClient(unittest.TestCase):
         self.assertIsNotNone(self.__class__.client.get('directory/subdirectory', verify='md5'),
                              'unable to get directory/subdirectory')
 
+    def test_get_dir_workers(self):
+        local_dir = self.__class__.client.get('directory', workers=3)
+        self.assertTrue(os.path.isfile(os.path.join(local_dir, 'data4')), 'data4 not copied')
+        self.assertTrue(os.path.isfile(os.path.join(local_dir, 'subdirectory', 'data5')), 'data5 not copied')
+
+        # data4 has no signature file
+        with self.assertRaisesRegex(Exception, 'data4'):
+            self.__class__.client.get('directory', verify='md5', workers=3)
+
+        with self.assertRaises(Exception):
+            self.__class__.client.get('directory', workers=0)
+
 if __name__ == '__main__':
     Helpers.configure_logger(logging.DEBUG)
     unittest.main()
@@ -1,14 +1,22 @@
 import logging
 import unittest
 import os
+import tempfile
+from ftplib import FTP, error_perm, error_temp
 from threading import Thread
 import time
+from contextlib import contextmanager
+from urllib.request import urlopen
 
 import sys
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),'..'))
 
 from quickftp.qftp_helper import Helpers
 from quickftp.qftp_server import QuickFtpServer
+from quickftp.qftp_index import QuickFtpChecksumIndex
+from quickftp.qftp_auth import QuickFtpPasswordVerifier
+from quickftp.qftp_server import QuickFtpAuthorizer
+from pyftpdlib.authorizers import AuthenticationFailed
 
 
 class TestServer(unittest.TestCase):
@@ -17,6 +25,38 @@ class TestServer(unittest.TestCase):
     """
     server = None
 
+    @contextmanager
+    def run_server(self, port, options='', user_options='', files=None):
+        """
+        Run a server in a thread, on a temporary ftp root dir with user1 (password1)
+        :param port: listening port
+        :param options: additional configuration lines, '%(tmp_dir)s' is replaced by the temporary directory
+        :param user_options: additional configuration lines of user1
+        :param files: dictionary {name: content} of the files created in the user1 directory before serving
+        :return: context of the server
+        """
+        config = ('ip: 127.0.0.1\nport: %d\nftp_root_dir: %s\n%sclients:\n'
+                  '  - name: user1\n    password: 7c6a180b36896a0a8c02787eeafb0e4c\n    directory: user1d\n%s')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            configfile = os.path.join(tmp_dir, 'server_conf.yml')
+            with open(configfile, 'w') as file:
+                file.write(config % (port, os.path.join(tmp_dir, 'root'), options % {'tmp_dir': tmp_dir},
+                                     user_options))
+            server = QuickFtpServer(configfile)
+            for name, content in (files or dict()).items():
+                with open(os.path.join(server.root_dir, 'user1d', name), 'wb') as file:
+                    file.write(content)
+            server_thread = Thread(target=server.serve)
+            server_thread.daemon = True
+            server_thread.start()
+            time.sleep(1)
+
+            try:
+                yield server
+            finally:
+                server.terminate()
+
     def test_config_file(self):
         # No config file
         exception_raised = False
@@ -28,6 +68,23 @@ class TestServer(unittest.TestCase):
 
         self.assertTrue(exception_raised, 'No exception raised')
 
+    def test_config_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            configfile = os.path.join(tmp_dir, 'conf.yml')
+            with open(configfile, 'w') as file:
+                file.write('ip: 127.0.0.1\nport: 21\n')
+            parameters = Helpers.get_param_from_config_file(configfile, ['ip'], ['port'])
+            self.assertEqual(parameters, {'ip': '127.0.0.1', 'port': 21})
+            parameters['ip'] = 'modified'
+            self.assertEqual(Helpers.get_param_from_config_file(configfile, ['ip'])['ip'], '127.0.0.1',
+                             'cached configuration modified by a caller')
+
+            # a changed file is parsed again
+            time.sleep(0.01)
+            with open(configfile, 'w') as file:
+                file.write('ip: 127.0.0.2\n')
+            self.assertEqual(Helpers.get_param_from_config_file(configfile, ['ip'], ['port']), {'ip': '127.0.0.2'})
+
     def test_terminate(self):
         server_thread = Thread(target=self.launch_server)
         server_thread.daemon = True
@@ -35,6 +92,198 @@ class TestServer(unittest.TestCase):
         time.sleep(10)
         self.__class__.server.terminate()
 
+    def test_multiprocess(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        server = QuickFtpServer(os.path.join(current_dir_path, 'conf/server_multiprocess_conf.yml'))
+        self.assertEqual(server.concurrency, 'multiprocess')
+
+        server_thread = Thread(target=server.serve)
+        server_thread.daemon = True
+        server_thread.start()
+        time.sleep(2)
+
+        try:
+            sessions = []
+            for i in range(4):
+                ftp = FTP()
+                ftp.connect('127.0.0.1', 12346)
+                ftp.login('user1', 'password1')
+                sessions.append(ftp)
+            for ftp in sessions:
+                self.assertEqual(ftp.pwd(), '/')
+
+            # hash read from the signature file
+            self.assertEqual(sessions[0].sendcmd('XMD5 data2'), '250 4c24aac86aa49adce486631bf365098f')
+            # no signature file and no checksum index
+            with self.assertRaises(error_perm):
+                sessions[0].sendcmd('XMD5 data1')
+
+            for ftp in sessions:
+                ftp.quit()
+        finally:
+            server.terminate()
+
+    def test_checksum_index(self):
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        root_dir = os.path.join(current_dir_path, 'server_ftp_dir')
+        data2 = os.path.join(root_dir, 'user1d', 'data2')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_file = os.path.join(tmp_dir, 'index.json')
+            index = QuickFtpChecksumIndex(root_dir, index_file)
+            index.refresh()
+            self.assertTrue(os.path.exists(index_file), 'index not saved')
+            self.assertEqual(index.lookup(data2, 'md5'), Helpers.read_signature(data2 + '.md5'))
+            # files are only hashed by refresh()
+            self.assertIsNone(index.lookup(index_file, 'md5'), 'file not indexed got a hash')
+
+            # read back from the index file
+            index = QuickFtpChecksumIndex(root_dir, index_file)
+            self.assertEqual(index.lookup(data2, 'sha256'), Helpers.read_signature(data2 + '.sha256'))
+
+    def test_checksum_index_commands(self):
+        with self.run_server(12352, 'checksum_index: %(tmp_dir)s/index.json\nchecksum_index_interval: 3600\n',
+                             files={'indexed': b'indexed'}) as server:
+            user_dir = os.path.join(server.root_dir, 'user1d')
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12352)
+            ftp.login('user1', 'password1')
+            self.assertEqual(ftp.sendcmd('XMD5 indexed')[4:].strip(),
+                             Helpers.compute_file_hash(os.path.join(user_dir, 'indexed'), 'md5'))
+
+            # a file created after the index build is not hashed by the command
+            with open(os.path.join(user_dir, 'new'), 'wb') as file:
+                file.write(b'new')
+            with self.assertRaisesRegex(error_perm, 'not indexed'):
+                ftp.sendcmd('XSHA256 new')
+            ftp.quit()
+
+    def test_authorizer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            users_file = os.path.join(tmp_dir, 'users')
+            with open(users_file, 'w') as file:
+                file.write('# name password directory\n')
+                file.write('user3 %s user3d\n' % QuickFtpPasswordVerifier.hash_password('password3', 'scrypt'))
+                file.write('user1 %s user1d\n' % QuickFtpPasswordVerifier.hash_password('other'))
+
+            authorizer = QuickFtpAuthorizer(users_file=users_file, root_dir=tmp_dir)
+            authorizer.add_user('user1', '7c6a180b36896a0a8c02787eeafb0e4c', tmp_dir)
+            authorizer.add_user('user2', QuickFtpPasswordVerifier.hash_password('password2'), tmp_dir)
+            self.assertIsNone(authorizer.user_table._QuickFtpUserTable__mtime, 'users file read by add_user')
+
+            authorizer.validate_authentication('user1', 'password1', None)
+            authorizer.validate_authentication('user2', 'password2', None)
+            # user of the users file, its directory is created at first use
+            authorizer.validate_authentication('user3', 'password3', None)
+            self.assertTrue(os.path.isdir(authorizer.get_home_dir('user3')), 'user3 directory not created')
+
+            # verified credentials are cached
+            authorizer.verifier = None
+            authorizer.validate_authentication('user2', 'password2', None)
+
+            authorizer.verifier = QuickFtpPasswordVerifier()
+            # the configuration file entry of user1 wins over the users file one
+            for username, password in [('user1', 'password2'), ('user1', 'other'), ('user2', 'password1'),
+                                       ('user4', 'password4')]:
+                with self.assertRaises(AuthenticationFailed):
+                    authorizer.validate_authentication(username, password, None)
+
+    def test_reload(self):
+        user2 = '  - name: user2\n    password: 6cb75f652a9b52798eb6cf2201057c73\n    directory: user2d\n'
+
+        with self.run_server(12347, 'config_reload_interval: 0.2\n') as server:
+            session = FTP()
+            session.connect('127.0.0.1', 12347)
+            session.login('user1', 'password1')
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12347)
+            with self.assertRaises(error_perm):
+                ftp.login('user2', 'password2')
+            ftp.close()
+
+            with open(server.configfile, 'a') as file:
+                file.write(user2)
+            os.utime(server.configfile, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+            time.sleep(1)
+
+            self.assertTrue(os.path.isdir(os.path.join(server.root_dir, 'user2d')), 'user2 directory not created')
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12347)
+            ftp.login('user2', 'password2')
+            ftp.quit()
+            # the existing session continues
+            self.assertEqual(session.pwd(), '/')
+            session.quit()
+
+    def test_throttling(self):
+        with self.run_server(12348, user_options='    read_limit: 65536\n    max_connections: 1\n',
+                             files={'data': os.urandom(160 * 1024)}):
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12348)
+            ftp.login('user1', 'password1')
+
+            # a single session for user1
+            other = FTP()
+            other.connect('127.0.0.1', 12348)
+            with self.assertRaises(error_temp):
+                other.login('user1', 'password1')
+            other.close()
+
+            data = []
+            start = time.monotonic()
+            ftp.retrbinary('RETR data', data.append)
+            elapsed = time.monotonic() - start
+            self.assertEqual(sum(len(chunk) for chunk in data), 160 * 1024)
+            self.assertGreater(elapsed, 1.5, 'transfer not throttled')
+            ftp.quit()
+
+    def test_hot_cache(self):
+        files = dict((name, name.encode('utf-8') * size) for name, size in [('small1', 100), ('small2', 100),
+                                                                            ('large', 200)])
+
+        def retr(ftp, name, rest=None):
+            data = []
+            ftp.retrbinary('RETR ' + name, data.append, rest=rest)
+            return b''.join(data)
+
+        with self.run_server(12351, 'hot_cache_size: 1000\nhot_file_max_size: 700\n', files=files) as server:
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12351)
+            ftp.login('user1', 'password1')
+            for i in range(3):
+                self.assertEqual(retr(ftp, 'small1'), b'small1' * 100)
+            self.assertEqual(retr(ftp, 'small1', rest=594), b'small1')
+            self.assertEqual(retr(ftp, 'large'), b'large' * 200)
+            self.assertEqual(server.metrics.get('quickftp_server_hot_cache_total', result='miss'), 1)
+            self.assertEqual(server.metrics.get('quickftp_server_hot_cache_total', result='hit'), 3)
+
+            # a modified file is read again
+            time.sleep(0.01)
+            with open(os.path.join(server.root_dir, 'user1d', 'small1'), 'wb') as file:
+                file.write(b'changed')
+            self.assertEqual(retr(ftp, 'small1'), b'changed', 'modified file served from the cache')
+
+            # least recently used files are evicted
+            retr(ftp, 'small2')
+            self.assertLessEqual(server.metrics.get('quickftp_server_hot_cache_bytes'), 1000)
+            ftp.quit()
+
+    def test_metrics(self):
+        with self.run_server(12349, 'metrics_port: 12350\n', files={'data': b'Hello World'}):
+            ftp = FTP()
+            ftp.connect('127.0.0.1', 12349)
+            ftp.login('user1', 'password1')
+            ftp.retrbinary('RETR data', lambda data: None)
+            ftp.quit()
+            time.sleep(0.5)
+
+            with urlopen('http://127.0.0.1:12350/metrics') as response:
+                metrics = response.read().decode('utf-8')
+            self.assertIn('quickftp_server_logins_total{result="success"} 1', metrics)
+            self.assertIn('quickftp_server_transfer_bytes_total{command="RETR"} 11', metrics)
+            self.assertIn('quickftp_server_sessions 0', metrics)
+            self.assertIn('quickftp_server_command_seconds_count{command="PASS"} 1', metrics)
+
     def launch_server(self):
         current_dir_path = os.path.dirname(os.path.realpath(__file__))
         self.__class__.server = QuickFtpServer(os.path.join(current_dir_path, 'conf/server_conf.yml'))